@@ -1,7 +1,7 @@
 """Calculate distance theta and phi that describes a point from a centroid"""
 """Test Data location X:\Phagocytosis\sRBC\20190614cs1\track_4\test"""
 
-from numpy import arccos, arctan, split, sqrt, subtract,sign, mean
+from numpy import arccos, arctan, sqrt, subtract,sign, mean
 
 """Calculate distance theta and phi that describes a point from a centroid"""
 
@@ -14,18 +14,20 @@ def spherical_measurement(surface, to_cell):
 
     centroid = mean(to_cell.vertices, axis=0)
 
-    # pylint: disable-next=unbalanced-tuple-unpacking
-    x_coord, y_coord, z_coord = split(subtract(centroid, surface.vertices), 3, 1)
+    """Same single pass as spherical_transform in src/measure_commands.py, kept at the
+    vertex precision with in place updates instead of separate arrays of squares"""
+    offsets = subtract(centroid, surface.vertices, dtype=surface.vertices.dtype)
+    x_coord, y_coord, z_coord = offsets.T
 
-    z_squared = z_coord ** 2
-    y_squared = y_coord ** 2
-    x_squared = x_coord ** 2
+    distxy = x_coord * x_coord
+    distxy += y_coord * y_coord
+    dist = z_coord * z_coord
+    dist += distxy
+    sqrt(dist, out=dist)
+    sqrt(distxy, out=distxy)
 
-    dist = sqrt(z_squared + y_squared + x_squared)
-
-    distxy = sqrt(x_squared + y_squared)
-
-    theta = sign(y_coord)*arccos(x_coord / distxy)
+    theta = arccos(x_coord / distxy)
+    theta *= sign(y_coord)
 
     phi = arccos(z_coord / dist)
 
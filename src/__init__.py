@@ -43,6 +43,18 @@ class _MyAPI(BundleAPI):
         elif ci.name == "measure composite":
             func = measure_commands.composite_series
             desc = measure_commands.measure_composite_desc
+        elif ci.name == "measure multichannel":
+            func = measure_commands.multichannel_series
+            desc = measure_commands.measure_multichannel_desc
+        elif ci.name == "measure cache":
+            func = measure_commands.measure_cache
+            desc = measure_commands.measure_cache_desc
+        elif ci.name == "measure export":
+            func = measure_commands.export_series
+            desc = measure_commands.measure_export_desc
+        elif ci.name == "measure import":
+            func = measure_commands.import_series
+            desc = measure_commands.measure_import_desc
         elif ci.name == "surface recolor":
             func = measure_commands.recolor_surfaces
             desc = measure_commands.recolor_surfaces_desc
@@ -53,7 +65,7 @@ class _MyAPI(BundleAPI):
             func = measure_commands.topology_series
             desc = measure_commands.measure_topology_desc
         elif ci.name == "measure ridges":
-            func = measure_commands.measure_ridges
+            func = measure_commands.ridge_series
             desc = measure_commands.measure_ridges_desc
         elif ci.name == "find voids":
             func = measure_commands.voids_seires
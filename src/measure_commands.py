@@ -12,95 +12,312 @@ from chimerax.surface import vertex_convexity
 from chimerax.atomic import AtomsArg
 from chimerax.core.commands import (BoolArg, Bounded, CmdDesc, ColormapArg,
                                     ColormapRangeArg, Int2Arg, IntArg,
-                                    SurfacesArg, StringArg, FloatArg, SurfaceArg, AxisArg)
+                                    SurfacesArg, StringArg, FloatArg, FloatsArg, SurfaceArg, AxisArg,
+                                    RepeatOf, ListOf, run)
 from chimerax.core.commands.cli import EnumOf
 from chimerax.map.volumecommand import volume
-from chimerax.std_commands.cd import (cd)
-from os.path import exists
+import atexit
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
+from os import listdir, makedirs
+from os.path import abspath, exists, join
+from threading import Lock
 import numpy
 from chimerax.surface.dust import largest_blobs_triangle_mask 
 from numpy import (arccos, array, full, inf, isnan, mean, round, nan, nanmax, nanmean,
-                   nanmin, pi, ravel_multi_index, sign, split, sqrt, subtract,
-                   count_nonzero, swapaxes, savetxt, column_stack,nansum, nanstd,
+                   nanmin, pi, ravel_multi_index, sign, sqrt, subtract,
+                   count_nonzero, swapaxes, column_stack,nansum, nanstd,
                    unique, column_stack, round_, int64, abs, digitize, linspace,
-                   zeros, where, delete, shape, ravel, min, shape, isin,flip,
-                   ones,asarray)
+                   zeros, where, shape, ravel, min, shape, isin,flip,
+                   ones,asarray, arange, argsort, bincount, concatenate, cumsum,
+                   errstate, repeat, ogrid, floor, ceil, maximum, minimum,
+                   float32, float64, int32, cross, fromiter, lexsort, median, unravel_index)
 from scipy.ndimage import (binary_dilation, binary_erosion,
-                           generate_binary_structure, iterate_structure, gaussian_filter, gaussian_laplace)
+                           generate_binary_structure, iterate_structure, gaussian_laplace,
+                           map_coordinates, label as ndimage_label)
+from scipy.signal import fftconvolve
+from scipy.sparse import csr_matrix
 from scipy.spatial import KDTree
 
 from skimage.morphology import (skeletonize,label)
 from skimage.feature import canny
 
-from chimerax.map_data import ArrayGridData 
+from chimerax.map_data import ArrayGridData, save_grid_data
 from chimerax.map import volume_from_grid_data
 
-import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from mpl_toolkits import mplot3d
 
-def distance_series(session, surface, to_surface, knn=5, palette=None, color_range=None, key=False):
+TARGET_RADII = {'sRBC': 2, 'mRBC': 2.7}
+
+VERTEX_ATTRIBUTES = ('distance', 'intensity', 'ClipTop', 'ClipBot', 'radialDistance', 'radialDistanceAbovePhi',
+                     'radialDistanceAbovePhiLimitxy', 'radialDistanceAbovePhiNoNans', 'theta', 'phi',
+                     'areasearch', 'edges', 'q_dist')
+EXPORT_LAYOUT = ('vertices', 'triangles', 'vertex_offsets', 'triangle_offsets', 'models')
+
+SURFACE_TREE_RING = 4
+BALL_PAIR_BUDGET = 2**22
+_surface_trees = OrderedDict()
+_surface_lock = Lock()
+
+
+def distance_series(session, surface, to_surface, knn=5, palette=None, color_range=None, key=False, parallel=1,
+                    precision='double', method='knn', signed=False, sample=None, sample_spacing=None):
     """Wrap the distance measurement for list of surfaces."""
-    [measure_distance(surface, to_surface, knn)
-     for surface, to_surface in zip(surface, to_surface)]
+    if parallel > 1:
+        # targets are raw geometry here, the trees are built on the worker threads
+        frames = ((s.vertices, (t.vertices, t.triangles) if method == 'mesh' else t.vertices)
+                  for s, t in zip(surface, to_surface))
+        for s, distance in zip(surface, map_frames(vertex_distance, frames, parallel, knn=knn, precision=precision,
+                                                   method=method, signed=signed, sample=sample,
+                                                   spacing=sample_spacing)):
+            s.distance = distance
+    else:
+        [measure_distance(surface, to_surface, knn, precision, method, signed, sample, sample_spacing)
+         for surface, to_surface in zip(surface, to_surface)]
     recolor_surfaces(session, surface, 'distance', palette, color_range, key)
 
 
 def intensity_series(session, surface, to_map, radius=15, palette=None, color_range=None,
-                      key=False, xnorm=None, ynorm=None, znorm=None, blob = 1, output='none'):
+                      key=False, xnorm=None, ynorm=None, znorm=None, blob = 1, output='none', method='knn',
+                      parallel=1, stream=None, precision='double', accumulate='double', sample=None,
+                      sample_spacing=None):
     """Wrap the intensity measurement for list of surfaces."""
-    [measure_intensity(session, surface, to_map, radius, xnorm, ynorm, znorm, blob,  output)
-    for surface, to_map in zip(surface, to_map)]
-    recolor_surfaces(session, surface, 'intensity', palette, color_range, key)
+    output = abspath(output)
+    with _results.batch():
+        if parallel > 1 or stream is not None:
+            frames = (frame_image(s, m, radius) for s, m in zip(surface, to_map))
+            intensities = map_frames(intensity_from_image, frames, parallel, radius=radius, method=method,
+                                     precision=precision, accumulate=accumulate, sample=sample,
+                                     spacing=sample_spacing)
+            for n, (s, face_intensity) in enumerate(zip(surface, intensities)):
+                hemisphere_intensity(session, s, face_intensity, xnorm, ynorm, znorm, blob, output)
+                if stream is not None:
+                    recolor_surface(session, s, 'intensity', palette, color_range, key and n == 0)
+                    flush_frame(s, stream, ['intensity', 'ClipTop', 'ClipBot'])
+        else:
+            [measure_intensity(session, surface, to_map, radius, xnorm, ynorm, znorm, blob,  output, method,
+                               precision, accumulate, sample, sample_spacing)
+            for surface, to_map in zip(surface, to_map)]
+        if stream is None:
+            recolor_surfaces(session, surface, 'intensity', palette, color_range, key)
 
 
-def composite_series(session, surface, green_map, magenta_map, radius=15, palette='green_magenta', green_range=None, magenta_range=None):
+def composite_series(session, surface, green_map, magenta_map, radius=15, palette='green_magenta', green_range=None, magenta_range=None,
+                     method='knn', parallel=1, stream=None, precision='double', accumulate='double'):
     """Wrap the composite measurement for list of surfaces."""
-    [measure_composite(surface, green_map, magenta_map, radius)
-        for surface, green_map, magenta_map in zip(surface, green_map, magenta_map)]
-    recolor_composites(session, surface, palette, green_range, magenta_range)
+    if parallel > 1 or stream is not None:
+        frames = (frame_image(s, g, radius) + frame_image(s, m, radius)[3:4]
+                  for s, g, m in zip(surface, green_map, magenta_map))
+        for s, (green, magenta) in zip(surface, map_frames(composite_from_image, frames, parallel,
+                                                            radius=radius, method=method,
+                                                            precision=precision, accumulate=accumulate)):
+            s.ch1, s.ch2 = green, magenta
+            if stream is not None:
+                composite_color(session, s, palette, green_range, magenta_range, (40, 240))
+                flush_frame(s, stream, ['ch1', 'ch2'])
+    else:
+        [measure_composite(surface, green_map, magenta_map, radius, method, precision, accumulate)
+            for surface, green_map, magenta_map in zip(surface, green_map, magenta_map)]
+    if stream is None:
+        recolor_composites(session, surface, palette, green_range, magenta_range)
+
+
+def multichannel_series(session, surface, to_map, radius=15, method='ball', palette='green_magenta',
+                        color_range=None, key=False, precision='double', accumulate='double'):
+    """Wrap the multichannel measurement for list of surfaces. to_map holds one series of maps per channel.
+    Defaults to the ball query, which matches measure intensity and composite channel by channel."""
+    if method == 'knn':
+        session.logger.warning('measure multichannel: knn caps the neighbors of the shared shell, zero voxels '
+                               'included, so channels differ from measure intensity; use method ball or '
+                               'convolve to match it')
+    [measure_multichannel(surface, maps, radius, method, precision, accumulate)
+        for surface, *maps in zip(surface, *to_map)]
+    if len(to_map) > 1:
+        recolor_composites(session, surface, palette, 'full', 'full')
+    else:
+        recolor_surfaces(session, surface, 'ch1', None, color_range, key)
+
+
+def flush_frame(surface, directory, attributes):
+    """Write one frame's per-vertex measurements to directory/<model id>.npz and drop them
+    from the surface model, so a streamed series does not pile results up in the session."""
+    makedirs(directory, exist_ok=True)
+    values = {name: getattr(surface, name) for name in attributes if hasattr(surface, name)}
+    numpy.savez(join(directory, '_'.join(str(i) for i in surface.id) + '.npz'), **values)
+    for name in values:
+        delattr(surface, name)
+
+
+def export_series(session, surface, directory, attributes=None):
+    """Write the per-vertex measurements of a series to .npy files in directory that load memory-mapped.
+    Frames are concatenated (ragged) along the first axis: frame n of every per-vertex array is
+    [vertex_offsets[n]:vertex_offsets[n+1]] and of triangles [triangle_offsets[n]:triangle_offsets[n+1]].
+    Frames missing an attribute are padded with NaN (or 0 for integer and boolean arrays).
+    Each frame is written straight into the mapped files, so the series is never held in memory twice."""
+    makedirs(directory, exist_ok=True)
+    if attributes is None:
+        attributes = vertex_attributes(surface)
+    vertex_offsets = concatenate([[0], cumsum([len(s.vertices) for s in surface])]).astype(int64)
+    triangle_offsets = concatenate([[0], cumsum([len(s.triangles) for s in surface])]).astype(int64)
+    numpy.save(join(directory, 'vertex_offsets.npy'), vertex_offsets)
+    numpy.save(join(directory, 'triangle_offsets.npy'), triangle_offsets)
+    numpy.save(join(directory, 'models.npy'), array([model_id(s) for s in surface]))
+
+    _export_arrays(directory, surface, 'vertices', vertex_offsets, lambda s: s.vertices)
+    _export_arrays(directory, surface, 'triangles', triangle_offsets, lambda s: s.triangles)
+    for name in attributes:
+        _export_arrays(directory, surface, name, vertex_offsets, lambda s: getattr(s, name, None))
+    session.logger.info(f'Exported {len(surface)} frames ({", ".join(attributes)}) to {directory}')
+
+
+def _export_arrays(directory, surface, name, offsets, values):
+    """Fill directory/<name>.npy frame by frame through a memory map."""
+    frames = [values(s) for s in surface]
+    present = [asarray(v) for v in frames if v is not None]
+    if not present:
+        return
+    dtype = present[0].dtype
+    out = numpy.lib.format.open_memmap(join(directory, name + '.npy'), mode='w+', dtype=dtype,
+                                       shape=(int(offsets[-1]),) + present[0].shape[1:])
+    for n, value in enumerate(frames):
+        out[offsets[n]:offsets[n+1]] = value if value is not None else (nan if dtype.kind in 'fc' else 0)
+    out.flush()
+    del out
+
+
+def vertex_attributes(surface):
+    """Names of the per-vertex measurements present on any surface of the series."""
+    names = [name for name in VERTEX_ATTRIBUTES if any(hasattr(s, name) for s in surface)]
+    channel = 1
+    while any(hasattr(s, f'ch{channel}') for s in surface):
+        names.append(f'ch{channel}')
+        channel += 1
+    return names
+
+
+def load_export(directory, mmap_mode='r'):
+    """Open an export_series directory as a dict of memory-mapped arrays keyed by file name."""
+    return {name[:-4]: numpy.load(join(directory, name), mmap_mode=mmap_mode)
+            for name in sorted(listdir(directory)) if name.endswith('.npy')}
+
+
+def import_series(session, surface, directory):
+    """Put exported per-vertex measurements back on the surfaces of the same model ids, without
+    recomputing them, so they can be recolored or measured further."""
+    arrays = load_export(directory)
+    offsets = arrays['vertex_offsets']
+    frames = {model: n for n, model in enumerate(arrays['models'])}
+    attributes = [name for name in arrays if name not in EXPORT_LAYOUT]
+    for s in surface:
+        n = frames.get(model_id(s))
+        if n is None or offsets[n+1] - offsets[n] != len(s.vertices):
+            session.logger.warning(f'No export of #{model_id(s)} with {len(s.vertices)} vertices in {directory}')
+            continue
+        for name in attributes:
+            setattr(s, name, array(arrays[name][offsets[n]:offsets[n+1]]))
+
+
+def map_frames(func, frames, parallel, **kwargs):
+    """Run func over per-frame arguments on a pool of parallel threads and yield the results in frame order.
+    frames is consumed lazily on the calling (main) thread, so ChimeraX models are only read there,
+    and at most 2*parallel frames are in flight at once. With parallel 1 this prefetches frame t+1
+    while frame t is measured; each frame's buffers are released once its result is yielded."""
+    with ThreadPoolExecutor(max_workers=parallel) as pool:
+        pending = deque()
+        for args in frames:
+            pending.append(pool.submit(func, *args, **kwargs))
+            if len(pending) >= 2 * parallel:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 
 def topology_series(session, surface, to_cell, radius= 8, target = 'sRBC',
                      size=(.1028,.1028,.1028), palette=None, color_range= 'full', key=False,
-                     phi_lim= 90, output = 'None'):
-    """this is ment to output a color mapped for topology metrics (phi, theta and distance from the target centroid) This is for the whole timeseries move on to the individual outputs"""
+                     phi_lim= 90, output = 'None', phi_lims=None, radii=None):
+    """this is ment to output a color mapped for topology metrics (phi, theta and distance from the target centroid) This is for the whole timeseries move on to the individual outputs
+    Giving phi_lims and/or radii sweeps every combination instead (see topology_sweep)."""
+    output = abspath(output)
     volume(session, voxel_size= size)
     wait(session,frames=1)
-    [measure_topology(session, surface, to_cell, radius, target, size, phi_lim, output)
-        for surface, to_cell in zip(surface, to_cell)]
+    if phi_lims is not None or radii is not None:
+        return topology_sweep(session, surface, to_cell, radii or [radius], target, size,
+                              phi_lims or [phi_lim], output)
+    with _results.batch():
+        [measure_topology(session, surface, to_cell, radius, target, size, phi_lim, output)
+            for surface, to_cell in zip(surface, to_cell)]
     recolor_surfaces(session, surface,'rpd', palette, color_range, key)
 
 def ridge_series(session, surface, to_surface, to_cell, radius = 8, size = (.1028,.1028,.1028), smoothing_iterations = 20,
                  thresh = 0.3, knn=10, palette = None, color_range='full', key= False, clip = 0.5, output= 'None', track = False,
-                 exclusion= 0.5):
+                 exclusion= 0.5, parallel=1, figures=True):
     
-    """This is designed to identify and track ridges that occur at phagosomes - YML"""
+    """This is designed to identify and track ridges that occur at phagosomes - YML
+    With parallel > 1 frames are measured on a pool of threads (see map_frames); models are only
+    read and written on the main thread and results are stored in frame order."""
+    output = abspath(output)
 
     volume(session, voxel_size= size)
     wait(session, frames=1)
 
-    [measure_ridges(session, surface, to_surface, to_cell, radius, smoothing_iterations, thresh, knn,
-                    size, clip, output, track, exclusion)
-        for surface, to_surface, to_cell in zip(surface, to_surface, to_cell)]
-    plt.close('all')
+    with _results.batch():
+        if parallel > 1:
+            parameters = dict(radius=radius, smoothing_iterations=smoothing_iterations, thresh=thresh,
+                              knn=knn, clip=clip, exclusion=exclusion)
+            frame_track = track and exists(output)
+            frames = (ridge_frame(s, t, c, frame_track)
+                      for s, t, c in zip(surface, to_surface, to_cell))
+            for s, ridges in zip(surface, map_frames(ridges_from_geometry, frames, parallel, radius=radius,
+                                                     thresh=thresh, knn=knn, size=size, clip=clip,
+                                                     exclusion=exclusion,
+                                                     smoothing_iterations=smoothing_iterations)):
+                store_ridges(session, s, ridges, output, parameters, figures)
+        else:
+            [measure_ridges(session, surface, to_surface, to_cell, radius, smoothing_iterations, thresh, knn,
+                            size, clip, output, track, exclusion, figures)
+                for surface, to_surface, to_cell in zip(surface, to_surface, to_cell)]
+    _figures.wait()
 
-    recolor_surfaces(session, surface, metric= 'edges', palette=None, color_range='full', key=False)
+    recolor_surfaces(session, surface, metric= 'edges', palette=palette, color_range=color_range, key=key)
 
-def voids_seires(session, surface, bg = 110, sd = 0.1, stg = 0.8, dups= None, per = 0.88, drop = 3 ):
+def voids_seires(session, surface, bg = 110, sd = 0.1, stg = 0.8, dups= None, per = 0.88, drop = 3, min_size = 58,
+                 output = None, parallel = 1 ):
 
     """This function is designed to use the surface models specify to generate new volumes that correspond to internal 
-    vesicles in the specified surface model. -YML"""
-    find_voids(session, surface, bg, sd, stg, dups, per, drop )
+    vesicles in the specified surface model. -YML
+    With output, the frames run through a pipeline of parallel threads (see map_frames), each void mask is
+    written to output as a compressed Chimera map as soon as it is found, and the masks are opened as one
+    volume series that reads each frame from disk when it is shown, so memory stays flat over long series."""
+    if output is None:
+        [find_voids(session, surface, bg, sd, stg, dups, per, drop, min_size )
+            for surface in surface]
+        return
+
+    makedirs(output, exist_ok=True)
+    frames = ((s.volume.full_matrix(),) for s in surface)
+    paths = []
+    for s, voids_found in zip(surface, map_frames(voids_from_map, frames, parallel, bg=bg, sd=sd, stg=stg,
+                                                  dups=dups, per=per, drop=drop, min_size=min_size)):
+        path = join(output, 'voids_' + '_'.join(str(i) for i in s.id) + '.cmap')
+        save_grid_data([ArrayGridData(voids_found.astype('uint8'))], path, session, format_name='cmap',
+                       options={'compress': True})
+        paths.append(path)
+    if paths:
+        run(session, 'open ' + ' '.join(f'"{path}"' for path in paths) + ' format cmap vseries true')
 
 def void_size_series(session, surface, track, tp, output):
     """centers to volumes
     author yml 20240327"""
-    void_size(session, surface, track, tp, output)
+    void_size(session, surface, track, tp, abspath(output))
 
 def Void_Motion_series(session,track,t,output):
     """Length of track
     author yml 20240327"""
-    Void_Motion(session,track,t,output)
+    Void_Motion(session,track,t,abspath(output))
 
 def recolor_surfaces(session, surface, metric='intensity', palette=None, color_range=None, key=False):
     """Wraps recolor_surface in a list comprehension"""
@@ -116,10 +333,183 @@ def recolor_composites(session, surface, palette='green_magenta', green_range=No
      for surface in surface]
 
 
-def measure_distance(surface, to_surface, knn):
-    """Measure the local motion of two surfaces."""
-    distance, _ = query_tree(surface.vertices, to_surface.vertices, knn=knn)
-    surface.distance = distance
+def measure_distance(surface, to_surface, knn, precision='double', method='knn', signed=False,
+                     sample=None, spacing=None):
+    """Measure the local motion of two surfaces.
+    method knn: mean distance to the knn nearest vertices of to_surface,
+    mesh: distance to the closest point on the triangles of to_surface, signed along their normals."""
+    target = surface_mesh_index(to_surface) if method == 'mesh' else surface_tree(to_surface)
+    surface.distance = vertex_distance(surface.vertices, target, knn, precision, method, signed, sample, spacing)
+
+
+def vertex_distance(vertices, target, knn=5, precision='double', method='knn', signed=False,
+                    sample=None, spacing=None):
+    """Distance from vertices to a target surface, safe to run on a worker thread.
+    target is a KDTree or vertex array for knn, and a mesh_index or (vertices, triangles) for mesh."""
+    if method == 'mesh':
+        index = mesh_index(*target) if len(target) == 2 else target
+        return sample_measure(lambda v: mesh_distance(v, signed=signed, index=index), vertices, sample, spacing)
+    return sample_measure(lambda v: query_tree(v, target, knn=knn, precision=precision)[0],
+                          vertices, sample, spacing)
+
+
+def sample_measure(measure, vertices, sample=None, spacing=None):
+    """Run measure on a spatially stratified subset of the vertices and spread the values to every
+    vertex from its nearest measured vertex. Without sample or spacing all vertices are measured."""
+    if not sample and not spacing:
+        return measure(vertices)
+    picked = sample_vertices(vertices, sample, spacing)
+    values = measure(vertices[picked])
+    _, nearest = KDTree(vertices[picked]).query(vertices, workers=-1)
+    return values[nearest]
+
+
+def sample_vertices(vertices, sample=None, spacing=None, tolerance=0.05):
+    """Indices of one vertex per cell of a cubic grid. The cell size is spacing, or for sample N
+    the size that keeps len(vertices)/N vertices (within tolerance), found by bisecting the cell
+    size between the typical vertex spacing and the extent of the surface."""
+    if len(vertices) == 0:
+        return arange(0)
+    if spacing:
+        return grid_sample(vertices, spacing)
+    if sample <= 1:
+        return arange(len(vertices))
+    target = len(vertices) / sample
+    probe = vertices[::max(1, len(vertices) // 1000)]
+    near, _ = KDTree(vertices).query(probe, k=2, workers=-1)
+    low, high = median(near[:, 1]) / 2, (vertices.max(axis=0) - vertices.min(axis=0)).max() * 2
+    for _ in range(40):
+        spacing = sqrt(low * high)
+        picked = grid_sample(vertices, spacing)
+        if abs(len(picked) - target) <= tolerance * target:
+            break
+        if len(picked) > target:
+            low = spacing
+        else:
+            high = spacing
+    return picked
+
+
+def grid_sample(vertices, spacing):
+    """Indices of the first vertex in each occupied cell of a cubic grid of the given cell size."""
+    cells = floor((vertices - vertices.min(axis=0)) / spacing).astype(int64)
+    keys = ravel_multi_index(cells.T, cells.max(axis=0) + 1)
+    _, picked = unique(keys, return_index=True)
+    return picked
+
+
+def surface_tree(surface):
+    """KDTree of the surface vertices, kept in the surface ring."""
+    return _surface_ring('tree', surface, lambda: KDTree(surface.vertices))
+
+
+def surface_mesh_index(surface):
+    """Point to triangle acceleration structure of the surface, kept in the surface ring."""
+    return _surface_ring('mesh', surface, lambda: mesh_index(surface.vertices, surface.triangles))
+
+
+def surface_geometry(surface):
+    """The (model id, vertices, triangles) of a surface, read on the main thread so the
+    structures built from it can be made on a worker thread (see geometry_convexity)."""
+    return id(surface), surface.vertices, surface.triangles
+
+
+def geometry_convexity(geometry, smoothing_iterations):
+    """Vertex convexity from a surface_geometry, kept (read-only) in the surface ring. Safe to
+    call from worker threads."""
+    _, vertices, triangles = geometry
+    def build():
+        convexity = vertex_convexity(vertices, triangles, smoothing_iterations)
+        convexity.setflags(write=False)
+        return convexity
+    return _geometry_ring(('convexity', smoothing_iterations), geometry, build)
+
+
+def _surface_ring(kind, surface, build):
+    """Structures built from surface geometry. The last few are kept in a ring keyed by the
+    surface model and its vertex and triangle arrays, so overlapping series and re-runs reuse them."""
+    return _geometry_ring(kind, surface_geometry(surface), build)
+
+
+def _geometry_ring(kind, geometry, build):
+    """The surface ring itself, keyed by a surface_geometry. Structures are built outside the lock
+    so worker threads build them concurrently; a structure built twice is simply replaced."""
+    owner, vertices, triangles = geometry
+    key = kind, owner, id(vertices), id(triangles)
+    with _surface_lock:
+        if key in _surface_trees:
+            _surface_trees.move_to_end(key)
+            return _surface_trees[key][2]
+    built = build()
+    with _surface_lock:
+        # hold the geometry arrays so their ids are not reused while the structure is cached
+        _surface_trees[key] = vertices, triangles, built
+        while len(_surface_trees) > SURFACE_TREE_RING:
+            _surface_trees.popitem(last=False)
+    return built
+
+
+def mesh_index(vertices, triangles):
+    """Acceleration structure for point to triangle distances. The nearest vertex bounds the
+    distance to the mesh from above; every triangle whose centroid lies within that bound plus
+    the largest centroid to corner reach is then a candidate for the closest point."""
+    corners = vertices[triangles]
+    centroids = corners.mean(axis=1)
+    reach = sqrt(((corners - centroids[:, None]) ** 2).sum(axis=2)).max() if len(corners) else 0
+    normals = cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    return KDTree(vertices), KDTree(centroids), corners, normals, reach
+
+
+def mesh_distance(points, vertices=None, triangles=None, signed=False, index=None, chunk=50000):
+    """Distance from each point to the closest point on a triangle mesh, positive on the side the
+    triangle normals point to when signed. Pass a prebuilt mesh_index or the vertices and triangles."""
+    vertex_tree, centroid_tree, corners, normals, reach = index or mesh_index(vertices, triangles)
+    distance = full(len(points), nan)
+    for start in range(0, len(points), chunk):
+        pts = points[start:start + chunk]
+        bound, _ = vertex_tree.query(pts, workers=-1)
+        candidates = centroid_tree.query_ball_point(pts, bound + reach, workers=-1)
+        counts = fromiter(map(len, candidates), dtype=int64, count=len(pts))
+        tri = fromiter(chain.from_iterable(candidates), dtype=int64, count=counts.sum())
+        rows = repeat(arange(len(pts)), counts)
+        delta = pts[rows] - closest_point_on_triangle(pts[rows], *swapaxes(corners[tri], 0, 1))
+        dist = sqrt((delta**2).sum(axis=1))
+        # closest candidate of each point: first entry per row after sorting by row then distance
+        order = lexsort((dist, rows))
+        best = order[(cumsum(counts) - counts)[counts > 0]]
+        if signed:
+            dist[best] *= sign((delta[best] * normals[tri[best]]).sum(axis=1))
+        distance[start + rows[best]] = dist[best]
+    return distance
+
+
+def closest_point_on_triangle(p, a, b, c):
+    """Closest point to each p on the triangle (a, b, c), vectorized over rows
+    (Ericson, Real-Time Collision Detection, 5.1.5)."""
+    ab, ac = b - a, c - a
+    ap, bp, cp = p - a, p - b, p - c
+    d1, d2 = (ab * ap).sum(axis=1), (ac * ap).sum(axis=1)
+    d3, d4 = (ab * bp).sum(axis=1), (ac * bp).sum(axis=1)
+    d5, d6 = (ab * cp).sum(axis=1), (ac * cp).sum(axis=1)
+    va, vb, vc = d3 * d6 - d5 * d4, d5 * d2 - d1 * d6, d1 * d4 - d3 * d2
+    with errstate(invalid='ignore', divide='ignore'):
+        on_ab = a + (d1 / (d1 - d3))[:, None] * ab
+        on_ac = a + (d2 / (d2 - d6))[:, None] * ac
+        on_bc = b + ((d4 - d3) / ((d4 - d3) + (d5 - d6)))[:, None] * (c - b)
+        denom = va + vb + vc
+        on_face = a + (vb / denom)[:, None] * ab + (vc / denom)[:, None] * ac
+    regions = [(d1 <= 0) & (d2 <= 0),
+               (d3 >= 0) & (d4 <= d3),
+               (vc <= 0) & (d1 >= 0) & (d3 <= 0),
+               (d6 >= 0) & (d5 <= d6),
+               (vb <= 0) & (d2 >= 0) & (d6 <= 0),
+               (va <= 0) & ((d4 - d3) >= 0) & ((d5 - d6) >= 0)]
+    points = [a, b, on_ab, c, on_ac, on_bc]
+    closest = on_face
+    # apply in reverse so the first matching region wins
+    for region, point in zip(regions[::-1], points[::-1]):
+        closest = where(region[:, None], point, closest)
+    return closest
 
 
 def measure_topology(session, surface, to_cell, radius=8, target='sRBC', size=[0.1028,0.1028,0.1028],
@@ -131,32 +521,16 @@ def measure_topology(session, surface, to_cell, radius=8, target='sRBC', size=[0
     Date:20230614"""
     
     """Tell the system what target you are computing the areal roughness of."""
-    if target == 'sRBC':
-        target_r = 2
-    elif target =='mRBC':
-        target_r = 2.7
-    else:
+    target_r = TARGET_RADII.get(target)
+    if target_r is None:
         return
     #Target not recognized
 
     """Define the target centroid from mid-range x, y and z coordinates."""
     centroid = mean(to_cell.vertices, axis=0)
 
-    """Vertice x,y and z distances from centroid"""
-    x_coord, y_coord, z_coord = split(subtract(surface.vertices, centroid), 3, 1)
-
-    x_coord = x_coord.flatten()
-    y_coord = y_coord.flatten()
-    z_coord = z_coord.flatten()
-    """Converting the cartesian system into spherical coordinates"""
-    z_squared = z_coord ** 2
-    y_squared = y_coord ** 2
-    x_squared = x_coord ** 2
-    
-    distance = sqrt(z_squared + y_squared + x_squared)
-    distxy = sqrt(x_squared + y_squared)
-    theta = sign(y_coord)*arccos(x_coord / distxy)
-    phi = arccos(z_coord / distance) * (180/pi)
+    """Vertice x,y and z distances from centroid converted into spherical coordinates"""
+    x_coord, y_coord, z_coord, distance, distxy, theta, phi = spherical_coords(surface, centroid)
 
     """Logic to identify vertices in the targets local (defined by radius input) around target's upper hemisphere"""
     abovePhi = phi <= phi_lim
@@ -239,43 +613,132 @@ def measure_topology(session, surface, to_cell, radius=8, target='sRBC', size=[0
     """Text file output"""
     path = exists(output)
     if path == True:
-        cd(session,str(output))
-        with open('Areal Surface Roughness.csv', 'ab') as f:
-            savetxt(f, column_stack([surface.ArealRoughness, surface.ArealRoughness_STD, surface.area, surface.ArealRoughnessperArea]),
-                     header=f"Areal-Surface-Roughness-S_q STD_Areal-Rougheness Surface_Area ArealRoughness/um^2", comments='')
+        _results.add(output, 'Areal Surface Roughness', model_id(surface), surface.id[1], 'topology',
+                     dict(radius=radius, target=target, phi_lim=phi_lim),
+                     S_q=surface.ArealRoughness, S_q_STD=surface.ArealRoughness_STD,
+                     Surface_Area=surface.area, S_q_per_um2=surface.ArealRoughnessperArea)
     else:
         return surface.radialDistanceAbovePhiNoNans
 
+def topology_sweep(session, surface, to_cell, radii, target='sRBC', size=(.1028,.1028,.1028),
+                   phi_lims=(90,), output='None'):
+    """Areal roughness of every frame for each phi_lim x radius combination, written as one table.
+    Each frame gets one spherical transform; IRDFC, S_q and S_q STD for the whole grid come from
+    2D cumulative counts and sums, and the area from one voxel binning per radius."""
+    target_r = TARGET_RADII.get(target)
+    if target_r is None:
+        return
+    phi_lims = numpy.sort(asarray(phi_lims, dtype=float64))
+    radii = numpy.sort(asarray(radii, dtype=float64))
+    grid_phi, grid_radius = numpy.meshgrid(phi_lims, radii, indexing='ij')
+
+    header = "Frame Phi_Limit Radius IRDFC S_q S_q_STD Surface_Area S_q_per_um2"
+    rows = []
+    with _results.batch():
+        for surface, to_cell in zip(surface, to_cell):
+            centroid = mean(to_cell.vertices, axis=0)
+            x_coord, y_coord, z_coord, distance, distxy, theta, phi = spherical_coords(surface, centroid)
+            IRDFC, STD = roughness_sweep(distance, phi, phi_lims, radii, target_r)
+            Area_S = area_sweep(x_coord, y_coord, z_coord, distance, phi, phi_lims, radii, target_r, size)
+            ArealRoughness = sqrt(IRDFC**2/(2*pi*target_r**2))
+            with errstate(divide='ignore', invalid='ignore'):
+                ArealRoughnessperArea = ArealRoughness / Area_S
+            columns = [grid_phi, grid_radius, IRDFC, ArealRoughness, STD/(2*pi*target_r**2),
+                       Area_S, ArealRoughnessperArea]
+            rows.append(column_stack([full(grid_phi.size, surface.id[1])] + [c.ravel() for c in columns]))
+            if exists(output):
+                _results.add(output, 'Areal Surface Roughness Sweep', model_id(surface), surface.id[1],
+                             'topology_sweep', dict(target=target),
+                             **dict(zip(header.split()[1:], rows[-1][:, 1:].T)))
+    table = concatenate(rows) if rows else zeros((0, 8))
+
+    if not exists(output):
+        session.logger.info(header + '\n' + '\n'.join(' '.join('%.6g' % v for v in row) for row in table))
+    return table
+
+
+def roughness_sweep(distance, phi, phi_lims, radii, target_r):
+    """Mean and standard deviation of distance over phi <= phi_lim & target_r < distance < radius for
+    every (sorted) phi_lim x radius. Each vertex is binned once by the first phi_lim and radius that
+    include it; cumulative sums of the binned counts, sums and squares give every combination."""
+    inside = distance > target_r
+    d = asarray(distance[inside], dtype=float64)
+    p_bin = numpy.searchsorted(phi_lims, phi[inside], side='left')
+    r_bin = numpy.searchsorted(radii, d, side='right')
+    keep = (p_bin < len(phi_lims)) & (r_bin < len(radii))
+    flat = p_bin[keep]*len(radii) + r_bin[keep]
+    d = d[keep]
+
+    grid = (len(phi_lims), len(radii))
+    def cumulative(weights=None):
+        binned = bincount(flat, weights=weights, minlength=grid[0]*grid[1]).reshape(grid)
+        return binned.cumsum(axis=0).cumsum(axis=1)
+    count, total, squares = cumulative(), cumulative(d), cumulative(d*d)
+
+    with errstate(divide='ignore', invalid='ignore'):
+        average = total / count
+        std = sqrt(maximum(squares / count - average**2, 0))
+    return average, std
+
+
+def area_sweep(x_coord, y_coord, z_coord, distance, phi, phi_lims, radii, target_r, size):
+    """ImgReconstruct area of the topology search for every phi_lim x radius. The voxel keys of all
+    vertices are binned once per radius and each phi_lim only selects among them; vertices outside
+    the radial search fall in the origin voxel, as they do in measure_topology."""
+    area = zeros((len(phi_lims), len(radii)))
+    xyz = column_stack((x_coord, y_coord, z_coord))
+    for j, radius in enumerate(radii):
+        steps = int64(round_(abs((2*radius)/(size[0]))))
+        edges = linspace(-1*(radius), radius, steps)
+        shape = (steps + 1,) * 3
+        keys = ravel_multi_index(digitize(xyz, edges).T, shape)
+        origin = ravel_multi_index(digitize(zeros((1, 3)), edges).T, shape)[0]
+        radialClose = (distance < radius) & (distance > target_r)
+        for i, phi_lim in enumerate(phi_lims):
+            abovePhi = (phi <= phi_lim) & (distance != 0)
+            voxels = unique(where(radialClose[abovePhi], keys[abovePhi], origin))
+            voxels = column_stack(unravel_index(voxels, shape))
+            area[i, j] = count_nonzero(ImgFromVoxels(voxels, steps)) * size[0]*size[1]
+    return area
+
+
 def measure_ridges(session, surface, to_surface, to_cell,  radius = 8, smoothing_iterations = 20,
                     thresh = 0.3, knn=10, size=[0.1028,0.1028,0.1028], clip=0.5, output= 'None', track = False,
-                    exclusion = 0.5):
-    
+                    exclusion = 0.5, figures = True):
+    """Identify high curvature lamella edges (ridges) around the target of one frame, and with
+    track true the mean distance from them to the ridges of to_surface (the next frame)."""
+    """Tracking is only reported together with an output directory"""
+    track = track and exists(output)
+    ridges = ridges_from_geometry(*ridge_frame(surface, to_surface, to_cell, track),
+                                  radius, thresh, knn, size, clip, exclusion, smoothing_iterations)
+    return store_ridges(session, surface, ridges, output, dict(
+        radius=radius, smoothing_iterations=smoothing_iterations, thresh=thresh, knn=knn, clip=clip,
+        exclusion=exclusion), figures)
+
+
+def ridge_frame(surface, to_surface, to_cell, track):
+    """Read what a ridge measurement needs from the models, on the main thread: the surface
+    geometry, its spherical coordinates about the target centroid, and with track the geometry
+    and distances of to_surface. The convexity is left to ridges_from_geometry."""
     """Define the target centroid from mid range x,y and z coordinates."""
     centroid = mean(to_cell.vertices, axis=0)
+    coords = spherical_coords(surface, centroid)
+    if track:
+        target = surface_geometry(to_surface), spherical_coords(to_surface, centroid)[3]
+    else:
+        target = None
+    return surface_geometry(surface), coords, target
 
-    """Vertice x,y and z coordinates from centroid"""
-    x_coord, y_coord, z_coord = split(subtract(surface.vertices, centroid), 3, 1)
-
-    """Defining coordinates for surface t"""
-    x_coord = x_coord.flatten()
-    y_coord = y_coord.flatten()
-    z_coord = z_coord.flatten()
 
-    """Converting the cartesian coordinates into spherical coordinates for surface t"""
-    z_squared = z_coord ** 2
-    y_squared = y_coord ** 2
-    x_squared = x_coord ** 2
-    
-    distance = sqrt(z_squared + y_squared + x_squared)
-    distxy = sqrt(x_squared + y_squared)
-    theta = sign(y_coord)*arccos(x_coord / distxy)
-    phi = arccos(z_coord / distance) * (180/pi)
+def ridges_from_geometry(geometry, coords, target, radius, thresh, knn, size, clip, exclusion,
+                         smoothing_iterations=20):
+    """The ridge measurement from plain arrays (see ridge_frame), safe to run on a worker thread.
+    Returns a dict of the per-vertex and per-frame results."""
+    """Vertice x,y and z coordinates from centroid converted into spherical coordinates for surface t"""
+    x_coord, y_coord, z_coord, distance, distxy, theta, phi = coords
+    vertices = geometry[1]
+    con = geometry_convexity(geometry, smoothing_iterations)
 
-    """Paletting options for R, phi, and theta for surface t"""
-    surface.radialDistance = distance
-    surface.theta = theta
-    surface.phi = phi
-    
     """Defining search restrictions"""
     sphere = distance  < radius
 
@@ -283,169 +746,278 @@ def measure_ridges(session, surface, to_surface, to_cell,  radius = 8, smoothing
     except ValueError:  #raised if `Clip` is empty.
         pass
 
-    """Defining surfaces t and t+1 convexity without paletting"""
-    con = vertex_convexity(surface.vertices, surface.triangles, smoothing_iterations)
-    
+    """Surface t convexity without paletting"""
     ind = (con > thresh)
 
-    car = zeros(shape(surface.vertices))
+    car = zeros(shape(vertices))
 
-    car[:,0]= surface.vertices[:,0]*ind*sphere
-    car[:,1]= surface.vertices[:,1]*ind*sphere
-    car[:,2]= surface.vertices[:,2]*ind*sphere
+    car[:,0]= vertices[:,0]*ind*sphere
+    car[:,1]= vertices[:,1]*ind*sphere
+    car[:,2]= vertices[:,2]*ind*sphere
     
     """Solving for the surface area of high curved regions and the high curve path length"""
 
     """High curve edges"""
-    surface.edges = ind * sphere *Clip + 0
+    edges = ind * sphere *Clip + 0
 
     """search limitations """
     SearchLimit = sphere * Clip
 
-    """Reconstructed image"""
-    ArtImg_edges = ImgReconstruct(surface.edges, x_coord, y_coord, z_coord, SearchLim=surface.edges, radius=radius, size=size)
-    ArtImg_whole = ImgReconstruct(1 ,x_coord, y_coord, z_coord, SearchLim= SearchLimit, radius=radius, size=size)
+    """Reconstructed images, sharing the bounding box of the whole so they line up"""
+    box = ImgReconstructBox(1, x_coord, y_coord, z_coord, SearchLim=SearchLimit, radius=radius, size=size)
+    ArtImg_edges = ImgReconstruct(edges, x_coord, y_coord, z_coord, SearchLim=edges, radius=radius, size=size, box=box)
+    ArtImg_whole = ImgReconstruct(1 ,x_coord, y_coord, z_coord, SearchLim= SearchLimit, radius=radius, size=size, box=box)
     
     """Equivalent to surface dusting all membranes disconnected from the largest object"""
     ArtCC = label(ArtImg_whole)
     cc_num, countscc= unique(ArtCC,return_counts=True)
     fcc = countscc
-    fcc[fcc==max(fcc)] = 0
+    """excluding the background label, the cropped image is not always mostly background"""
+    fcc[cc_num==0] = 0
     dusted_value = cc_num[where(fcc==max(fcc))]
     dusted = ( ArtCC == dusted_value) + 0
 
     ArtImg = ArtImg_edges*dusted
 
-    """Surface Area of high curved regions"""
-    surface.Area = count_nonzero(ArtImg) * size[0]*size[1]
-
     """Skeletonizing the reconstructed image"""
     RidgePathLength = skeletonize((ArtImg*1),method='lee')
     """Connected components: paths"""
     RidgeCc = label(RidgePathLength)
-    _,counts=unique(RidgeCc,return_counts=True)
+    RidgeID,counts=unique(RidgeCc,return_counts=True)
     """excluding all zero points in the matrix / Image"""
     f=counts
-    f[f==max(counts)]=0
+    f[RidgeID==0]=0
     """size exclusion"""
     size_exclusion= exclusion / size[0]
     p=where(f >= size_exclusion)
-    histinfo=f[p]
+    above = isin(RidgeCc,p)==True
+
+    """Surface Area of high curved regions and the (above threshold) ridge path lengths"""
+    ridges = dict(radialDistance=distance, theta=theta, phi=phi, edges=edges,
+                  Area=count_nonzero(ArtImg) * size[0]*size[1],
+                  pathlength=count_nonzero(RidgePathLength) * size[0],
+                  pathlengthsabovethresh=count_nonzero(above)*size[0],
+                  ridge_ids=p[0], histinfo=f[p], positions=where(above))
+
+    if target is not None:
+        """Surface t+1 high curve vertices within the search radius"""
+        geometry_t, distance_t = target
+        vertices_t = geometry_t[1]
+        con_t = geometry_convexity(geometry_t, smoothing_iterations)
+        sphere_t = distance_t  < radius
+
+        ind_t = (con_t > thresh)
+
+        car_t = zeros(shape(vertices_t))
+
+        car_t[:,0]= vertices_t[:,0]*ind_t*sphere_t
+        car_t[:,1]= vertices_t[:,1]*ind_t*sphere_t
+        car_t[:,2]= vertices_t[:,2]*ind_t*sphere_t
+        query_distance, *_ = query_tree(car, car_t, knn=knn)
+
+        """The Average distance of the nearest neighbors"""
+        ridges['q_dist'] = query_distance
+    return ridges
 
-    surface.pathlengthsabovethresh= count_nonzero(isin(RidgeCc,p)==True)*size[0]
 
-    surface.pathlength = count_nonzero(RidgePathLength) * size[0]
-    surface.pathlengthsabovethresh= count_nonzero(isin(RidgeCc,p)==True)*size[0]
+def store_ridges(session, surface, ridges, output, parameters, figures=True):
+    """Put a ridge measurement on its surface and write its results, on the main thread.
+    With figures the skeleton plot is queued on the background figure writer."""
+    """Paletting options for R, phi, and theta for surface t"""
+    surface.radialDistance = ridges['radialDistance']
+    surface.theta = ridges['theta']
+    surface.phi = ridges['phi']
+    surface.edges = ridges['edges']
+    surface.Area = ridges['Area']
+    surface.pathlength = ridges['pathlength']
+    surface.pathlengthsabovethresh = ridges['pathlengthsabovethresh']
 
     """Text file output"""
     path = exists(output)
     if path == True:
-        cd(session,str(output))
-        with open('RidgeInfo.csv', 'ab') as f:
-            savetxt(f, column_stack([surface.Area, surface.pathlength, surface.pathlengthsabovethresh, p]),
-                     header=f"High_Curve_Surface_Area Lamella_pathlength Lamella_pathlength_above_thresh", comments='')
-        with open('RidgehistInfo.csv', 'ab') as f:
-            savetxt(f, [histinfo],
-                    header=f"hist_of_ridge_sizes", comments='')
-        pos=where(isin(RidgeCc,p)==True)
-        frame=str(surface.id[1])
-        fig= plt.figure()
-        ax = fig.add_subplot(111,projection='3d')
-        ax.scatter(pos[0], pos[1], pos[2], c='black')
-        ax.set_title('Skeletonized Edges')
-        ax.set_xlabel('X \u03BCm $10^{-1}$')
-        ax.set_xlim(0,pos[0])
-        ax.set_xticks([0,pos[0]])
-        ax.set_ylabel('Y \u03BCm $10^{-1}$')
-        ax.set_ylim(0,pos[1])
-        ax.set_yticks([0,pos[1]])
-        ax.set_zlabel('Z \u03BCm $10^{-1}$')
-        ax.set_zlim(0,pos[2])
-        ax.set_zticks([0,pos[2]])
-        """Ruffling graph"""
-        """ax.view_init(400,225,roll=None)"""
-        """Phagocytosis graph"""
-        ax.view_init(400,255,roll=None)
-        fig.set_size_inches(5.5, 5.5)
-        plt.savefig(frame,dpi=350)
+        _results.add(output, 'RidgeInfo', model_id(surface), surface.id[1], 'ridges', parameters,
+                     High_Curve_Surface_Area=surface.Area, Lamella_pathlength=surface.pathlength,
+                     Lamella_pathlength_above_thresh=surface.pathlengthsabovethresh,
+                     Ridge_count=len(ridges['ridge_ids']))
+        _results.add(output, 'RidgehistInfo', model_id(surface), surface.id[1], 'ridges', parameters,
+                     Ridge_ID=ridges['ridge_ids'], Ridge_size=ridges['histinfo'])
+        if figures:
+            _figures.submit(ridge_figure, join(output, str(surface.id[1])), ridges['positions'])
     else:
         return surface.pathlength
 
-    if track == True:
-        x_coord_t, y_coord_t, z_coord_t = split(subtract(to_surface.vertices, centroid), 3, 1)
-        """Defining coordinates for surface t+1"""
-        x_coord_t = x_coord_t.flatten()
-        y_coord_t = y_coord_t.flatten()
-        z_coord_t = z_coord_t.flatten()
-        """Converting the cartesian coordinates into spherical coordinates for surface t+1"""
-        z_squared_t = z_coord_t ** 2
-        y_squared_t = y_coord_t ** 2
-        x_squared_t = x_coord_t ** 2
-
-        distance_t = sqrt(z_squared_t + y_squared_t + x_squared_t)
-        sphere_t = distance_t  < radius
-        con_t = vertex_convexity(to_surface.vertices, to_surface.triangles, smoothing_iterations)
-
-        ind_t = (con_t > thresh)
-
-        car_t = zeros(shape(to_surface.vertices))
-
-        car_t[:,0]= to_surface.vertices[:,0]*ind_t*sphere_t
-        car_t[:,1]= to_surface.vertices[:,1]*ind_t*sphere_t
-        car_t[:,2]= to_surface.vertices[:,2]*ind_t*sphere_t
-        query_distance,_=query_tree(car, car_t, knn=knn)
-
-        """The Average distance of the nearest neighbors"""
-        surface.q_dist=query_distance
+    if 'q_dist' in ridges:
+        surface.q_dist = ridges['q_dist']
         return surface.q_dist
     else:
         return 
 
-def ImgReconstruct(Points, x_coord, y_coord, z_coord, SearchLim, radius, size):
-    """This script will reconstruct an image form the location of vertices in your rendered surface"""
-
-    """Logic statements for specific objects we care about"""
-    XYZ_SearchR = SearchLim
-    XYZ_deletes = where(XYZ_SearchR==0)
+def ridge_figure(path, pos):
+    """Scatter plot of the skeletonized ridge voxels, written to path on an Agg canvas.
+    The figure is not registered with pyplot, so it is released once written."""
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111,projection='3d')
+    ax.scatter(pos[0], pos[1], pos[2], c='black')
+    ax.set_title('Skeletonized Edges')
+    ax.set_xlabel('X \u03BCm $10^{-1}$')
+    ax.set_xlim(0,pos[0])
+    ax.set_xticks([0,pos[0]])
+    ax.set_ylabel('Y \u03BCm $10^{-1}$')
+    ax.set_ylim(0,pos[1])
+    ax.set_yticks([0,pos[1]])
+    ax.set_zlabel('Z \u03BCm $10^{-1}$')
+    ax.set_zlim(0,pos[2])
+    ax.set_zticks([0,pos[2]])
+    """Ruffling graph"""
+    """ax.view_init(400,225,roll=None)"""
+    """Phagocytosis graph"""
+    ax.view_init(400,255,roll=None)
+    fig.set_size_inches(5.5, 5.5)
+    fig.savefig(path,dpi=350)
+    fig.clear()
+
+
+class FigureQueue:
+    """Writes figures on a bounded pool of background threads so rendering stays off the
+    measurement loop. At most pending figures are queued; submit waits for the oldest beyond that."""
+
+    def __init__(self, workers=2, pending=4):
+        self.workers = workers
+        self.pending = pending
+        self.pool = None
+        self.futures = deque()
+
+    def submit(self, draw, *args):
+        """Queue draw(*args) on the pool."""
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        while len(self.futures) >= self.pending:
+            self.futures.popleft().result()
+        self.futures.append(self.pool.submit(draw, *args))
+
+    def wait(self):
+        """Block until every queued figure is written, raising the first rendering error."""
+        while self.futures:
+            self.futures.popleft().result()
+
+
+_figures = FigureQueue()
+
+SPHERICAL_CACHE_SIZE = 8
+_spherical_cache = OrderedDict()
+
+
+def spherical_coords(surface, centroid):
+    """Memoized spherical_transform of the surface vertices about centroid, keyed by the surface
+    model, its vertex array and the centroid. The arrays are shared, so they are read only."""
+    vertices = surface.vertices
+    centroid = asarray(centroid)
+    key = id(surface), id(vertices), centroid.tobytes()
+    if key in _spherical_cache:
+        _spherical_cache.move_to_end(key)
+        return _spherical_cache[key][1]
+    coords = spherical_transform(vertices, centroid)
+    for array_ in coords:
+        array_.flags.writeable = False
+    # hold the vertex array so its id is not reused while the result is cached
+    _spherical_cache[key] = vertices, coords
+    while len(_spherical_cache) > SPHERICAL_CACHE_SIZE:
+        _spherical_cache.popitem(last=False)
+    return coords
+
+
+def spherical_transform(vertices, centroid):
+    """x, y and z offsets of the vertices from centroid, their distance, distance in the xy plane,
+    theta (radians) and phi (degrees), in one pass at the vertex precision with in place updates."""
+    offsets = subtract(vertices, centroid, dtype=vertices.dtype)
+    x_coord, y_coord, z_coord = offsets.T
+    distxy = x_coord * x_coord
+    distxy += y_coord * y_coord
+    distance = z_coord * z_coord
+    distance += distxy
+    sqrt(distance, out=distance)
+    sqrt(distxy, out=distxy)
+    with errstate(invalid='ignore', divide='ignore'):
+        theta = arccos(x_coord / distxy)
+        theta *= sign(y_coord)
+        phi = arccos(z_coord / distance)
+    phi *= 180 / pi
+    return x_coord, y_coord, z_coord, distance, distxy, theta, phi
+
+
+def ImgReconstruct(Points, x_coord, y_coord, z_coord, SearchLim, radius, size, box=None):
+    """This script will reconstruct an image form the location of vertices in your rendered surface.
+    Vertices are binned straight to integer voxel indices and only the bounding box of the occupied
+    voxels (or the given box from ImgReconstructBox) is allocated, filled and eroded, so memory
+    follows the occupied voxels rather than (2*radius/size)**3."""
+    voxels, steps = ImgReconstructVoxels(Points, x_coord, y_coord, z_coord, SearchLim, radius, size)
+    return ImgFromVoxels(voxels, steps, box)
+
+
+def ImgFromVoxels(voxels, steps, box=None):
+    """Filled int8 image of occupied voxels over their bounding box (or the given box)."""
+    low, high = box if box is not None else _voxel_box(voxels, steps)
 
-    """Solving for unique X,Y,Z coordinates in the search"""
-    xx=x_coord[:]*Points
-    yy=y_coord[:]*Points
-    zz=z_coord[:]*Points
+    """Making an artificial binary mask of binned vertices into 'pixels' from location of vertices"""
+    ArtImgxyz = zeros(high - low, dtype=bool)
+    ArtImgxyz[tuple((voxels - low).T)] = True
 
-    xyz_raw = column_stack((xx,yy,zz))
+    """gaussian_filter(sigma=.2) > 0 reaches one voxel along each axis: a 3x3x3 dilation"""
+    ArtImg = binary_erosion(binary_dilation(ArtImgxyz, structure=ones((3, 3, 3), dtype=bool)),
+                            border_value=1, iterations=1)
+    ArtImg = ArtImg.astype('int8')
+    return ArtImg
 
-    """Reconstruct the image from points we define"""
-    xyz=unique(delete(xyz_raw,XYZ_deletes,axis=0),axis=0)
 
-    """Defining the pixel size from human defined parameter"""
-    width = size[0]
+def ImgReconstructBox(Points, x_coord, y_coord, z_coord, SearchLim, radius, size):
+    """Voxel bounding box (low, high) of a reconstruction, to share between images that must line up."""
+    return _voxel_box(*ImgReconstructVoxels(Points, x_coord, y_coord, z_coord, SearchLim, radius, size))
 
-    """Defining steps that will are approximately one pixel in length"""
-    steps = int64(round_(abs((2*radius)/(width))))
 
-    """Indexing the vertices that fall in one pixel of eachother along each axis""" 
-    """nearest neighbors approach"""    
-    xbins = digitize(xyz[:,0],linspace(-1*(radius),radius,steps))
-    ybins = digitize(xyz[:,1],linspace(-1*(radius),radius,steps))
-    zbins = digitize(xyz[:,2],linspace(-1*(radius),radius,steps))
+def ImgReconstructVoxels(Points, x_coord, y_coord, z_coord, SearchLim, radius, size):
+    """Unique voxel indices (N x 3) of the vertices in the search, and the voxel steps per axis.
+    Deduplicates integer voxel keys instead of sorting float coordinates."""
 
-    """Making an artificial binary mask of binned vertices into 'pixels' from location of vertices"""
-    
-    ArtImgxyz= zeros([steps,steps,steps])
-    ArtImgxyz[xbins,ybins,zbins]= 1
+    """Solving for X,Y,Z coordinates in the search"""
+    keep = SearchLim != 0
+    xyz = column_stack((x_coord*Points, y_coord*Points, z_coord*Points))[keep]
 
-    ArtImg = binary_erosion(((gaussian_filter(ArtImgxyz,.2))>0),border_value=1,iterations=1)
-    ArtImg = ArtImg.astype('int8')
-    return ArtImg
+    """Defining steps that will are approximately one pixel in length"""
+    width = size[0]
+    steps = int64(round_(abs((2*radius)/(width))))
 
-def measure_intensity(session, surface, to_map, radius, xnorm, ynorm, znorm, blob, output):
-    """Measure the local intensity within radius r of the surface."""
-    image_info = get_image(surface, to_map)
-    masked_image = mask_image(*image_info)
-    image_coords, *flattened_indices = get_coords(masked_image)
-    _, index = query_tree(surface.vertices, image_coords.T, radius)
-    face_intensity = local_intensity(*flattened_indices, index)
+    """Indexing the vertices that fall in one pixel of eachother along each axis"""
+    voxels = digitize(xyz, linspace(-1*(radius), radius, steps))
+    keys = unique(ravel_multi_index(voxels.T, (steps + 1,) * 3))
+    voxels = column_stack(unravel_index(keys, (steps + 1,) * 3))
+    return voxels, steps
+
+
+def _voxel_box(voxels, steps):
+    """Occupied voxels grown by the 2 voxel reach of the dilation and erosion, within the full image."""
+    if len(voxels) == 0:
+        return zeros(3, dtype=int64), ones(3, dtype=int64)
+    low = maximum(voxels.min(axis=0) - 2, 0)
+    high = minimum(voxels.max(axis=0) + 3, steps)
+    return low, high
+
+
+def measure_intensity(session, surface, to_map, radius, xnorm, ynorm, znorm, blob, output, method='knn',
+                      precision='double', accumulate='double', sample=None, spacing=None):
+    """Measure the local intensity within radius r of the surface.
+    method knn: up to 199 nearest voxels within radius, ball: every voxel within radius,
+    convolve: spherical kernel convolution sampled at the vertices.
+    precision single keeps the image in its native type with float32 distances and int32 indices;
+    accumulate sets the type of the neighbor sums and convolutions. Against double precision the
+    relative error is below 1e-6 with double accumulation and below 1e-5 with single accumulation.
+    sample or spacing measure a stratified subset of vertices (see sample_measure)."""
+    face_intensity = channel_intensity(surface, to_map, radius, method, precision, accumulate, sample, spacing)
+    return hemisphere_intensity(session, surface, face_intensity, xnorm, ynorm, znorm, blob, output)
+
+
+def hemisphere_intensity(session, surface, face_intensity, xnorm, ynorm, znorm, blob, output):
+    """Store the measured intensity and, with a clip plane normal, split it into hemispheres."""
     surface.intensity = face_intensity
 
     """
@@ -503,32 +1075,97 @@ def measure_intensity(session, surface, to_map, radius, xnorm, ynorm, znorm, blo
         path = exists(output)
 
         if path == True:
-            cd(session,str(output))
-            with open('intensity.csv', 'ab') as f:
-                savetxt(f, column_stack([frame, topsum, botsum]),
-                        header=f"Frame Clip_Top Clip_Bot", comments='')
+            _results.add(output, 'intensity', model_id(surface), frame, 'intensity',
+                         dict(xnorm=xnorm, ynorm=ynorm, znorm=znorm, blob=blob),
+                         Clip_Top=topsum, Clip_Bot=botsum)
         else:
             return
         return surface.intensity, surface.ClipTop, surface.ClipBot
     else:
         return surface.intensity
     
-def find_voids(session, surface, bg, sd, stg, dups, per , drop ):
+def find_voids(session, surface, bg, sd, stg, dups, per , drop, min_size=58 ):
+    """Void mask volume of the surface's map, thresholded at dups levels from per down by drop.
+    The filtered image is kept per (volume version, bg, sd, stg) in void_components."""
+    components = void_components(surface, bg, sd, stg)
+    voids_found = components.voids(per, drop, dups if dups is not None else 4, min_size)
+    mask=ArrayGridData((voids_found))
+    volume_from_grid_data(mask,session)
+
+def void_components(surface, bg, sd, stg):
+    """VoidComponents of the edge and LoG filtered map of the surface. Each stage is kept in the
+    measurement cache under the parameters it depends on: the LoG of the map per data version, the
+    edge shaved LoG and height limit per (version, bg, sd) and the components per (version, bg, sd, stg),
+    so changing stg, per, drop, dups or minSize reuses the filtered volumes."""
+    data = surface.volume.data
+    version = _channel_cache.version(data)
+    key = ('void components', id(data)), version, bg, sd, stg
+    cached = _channel_cache.get(key)
+    if cached is not None:
+        return cached[0]
+
+    y = void_log(surface, version)
+    y_l, heightLimit = void_edges(surface, version, bg, sd)
+    components = VoidComponents(shave_image(y, y_l, stg), heightLimit)
+    _channel_cache.put(key, (components,), (surface, data))
+    return components
+
+def voids_from_map(mask_vol, bg, sd, stg, dups, per, drop, min_size=58):
+    """The find voids mask of a map's values without caching, safe to run on a worker thread."""
+    y_l, heightLimit = edge_log(mask_vol, bg, sd)
+    components = VoidComponents(shave_image(map_log(mask_vol), y_l, stg), heightLimit)
+    return components.voids(per, drop, dups if dups is not None else 4, min_size)
+
+def shave_image(y, y_l, stg):
+    """LoG of the map where it, or the edge shaved LoG, is above stg of its maximum."""
+    stlg = 0.8125 * stg
+
+    shadow=y
+    shadow_thresh=shadow>=(stg*numpy.max(shadow))
+
+    shadow_l=y_l
+    shadow_thresh_l=shadow_l>=(stlg*numpy.max(shadow_l))
 
-    mask_vol = surface.volume.full_matrix().copy()
+    img_shave = y*(shadow_thresh+shadow_thresh_l)
+    return img_shave
+
+def void_log(surface, version):
+    """Laplacian of Gaussian of the surface's map (float32), cached per data version."""
+    data = surface.volume.data
+    key = ('void log', id(data)), version
+    cached = _channel_cache.get(key)
+    if cached is not None:
+        return cached[0]
+    y = map_log(surface.volume.full_matrix())
+    _channel_cache.put(key, (y,), (surface, data))
+    return y
+
+def map_log(mask_vol):
+    """Laplacian of Gaussian of the map values as float32."""
+    return gaussian_laplace((mask_vol),sigma=.3,truncate=8).astype(float32)
+
+def void_edges(surface, version, bg, sd):
+    """LoG of the map shaved to the Canny edges of its bg/sd mask (float32) and the height limit
+    of the edges, cached per (data version, bg, sd)."""
+    data = surface.volume.data
+    key = ('void edges', id(data)), version, bg, sd
+    cached = _channel_cache.get(key)
+    if cached is not None:
+        return cached
+    y_l, heightLimit = edge_log(surface.volume.full_matrix(), bg, sd)
+    _channel_cache.put(key, (y_l, heightLimit), (surface, data))
+    return y_l, heightLimit
+
+def edge_log(mask_vol, bg, sd):
+    """LoG (float32) of the map shaved to the dilated Canny edges of its bg/sd mask, and the
+    height limit of the edges."""
     mean = nanmean(mask_vol,where=(mask_vol> bg))
     dev = nanstd(mask_vol,where=(mask_vol> bg))
 
     masked_image= (mask_vol >= (mean-(dev*sd)))
     masking= (masked_image<1)
 
-    blank=zeros(shape(masking))
-
-    for n in range( shape(masked_image)[0] ):
-        edge = canny(masked_image[n,:,:],sigma=1)
-        blank[n,:,:] = edge
-    
-
+    blank = slice_edges(masked_image)
 
     d=binary_dilation(blank,iterations=1)
 
@@ -540,246 +1177,112 @@ def find_voids(session, surface, bg, sd, stg, dups, per , drop ):
 
     shave=masked_image*(p+d)
 
-    y_l=gaussian_laplace((mask_vol*((shave+0) - (masking+0))),sigma=.3,truncate=3)
-    y=gaussian_laplace((mask_vol),sigma=.3,truncate=8)
-
-    stlg = 0.8125 * stg
-
-    shadow=y
-    shadow_thresh=shadow>=(stg*numpy.max(shadow))
-
-    shadow_l=y_l
-    shadow_thresh_l=shadow_l>=(stlg*numpy.max(shadow_l))
-
-    img_shave = y*(shadow_thresh+shadow_thresh_l)
+    y_l=gaussian_laplace((mask_vol*((shave+0) - (masking+0))),sigma=.3,truncate=3).astype(float32)
 
     heightMax = numpy.max(where(shave<=0.82),axis=1)[0]
     heightLimit= heightMax * 0.95
-
-    if dups is not None:
-        if dups == 1:
-            img_i = img_shave >= (per*numpy.max(img_shave))
-            dusted_i  =zeros(shape(img_shave))
-            img_int1=img_i.astype("uint8")
-            for n in range(shape(masked_image)[0]):
-                void = label(img_int1[n,:,:],background=0)
-                RegionID, RegionSize= unique(void,return_counts=True)
-                exclusion=asarray(RegionSize>58).nonzero()    
-                dusted_values=RegionID[exclusion]
-                count=numpy.sum(exclusion)
-                if count <= 10 or n>heightLimit:
-                    dusted_i[n,:,:] = ones(shape(void))
-                else:
-                    dusted_i[n,:,:] = void==dusted_values.any()
-            voids_found=((img_i-dusted_i))>0      
-            mask=ArrayGridData((voids_found))
-            volume_from_grid_data(mask,session)
-
-        elif dups ==2:
-            img_i = img_shave >= (per*numpy.max(img_shave))
-            dusted_i  =zeros(shape(img_shave))
-            img_int1=img_i.astype("uint8")
-            for n in range(shape(masked_image)[0]):
-                void = label(img_int1[n,:,:],background=0)
-                RegionID, RegionSize= unique(void,return_counts=True)
-                exclusion=asarray(RegionSize>58).nonzero()    
-                dusted_values=RegionID[exclusion]
-                count=numpy.sum(exclusion)
-                if count <= 10 or n>heightLimit:
-                    dusted_i[n,:,:] = ones(shape(void))
-                else:
-                    dusted_i[n,:,:] = void==dusted_values.any()
-    
-            img_ii = img_shave >= (((per-drop))*numpy.max(img_shave))
-            dusted_ii  =zeros(shape(img_shave))
-            
-            img_int2=img_ii.astype("uint8")
-            for n in range(shape(masked_image)[0]):
-                void = label(img_int2[n,:,:],background=0)
-                RegionID, RegionSize= unique(void,return_counts=True)
-                exclusion=asarray(RegionSize>58).nonzero()    
-                dusted_values=RegionID[exclusion]
-                count=numpy.sum(exclusion)
-                if count <= 10 or n>heightLimit:
-                    dusted_ii[n,:,:] = ones(shape(void))
-                else:
-                    dusted_ii[n,:,:] = void==dusted_values.any()
-
-            voids_found=((img_i-dusted_i) + (img_ii-dusted_ii))>0      
-            mask=ArrayGridData((voids_found))
-            volume_from_grid_data(mask,session)
-
-        elif dups ==3:
-            img_i = img_shave >= (per*numpy.max(img_shave))
-            dusted_i  =zeros(shape(img_shave))
-            img_int1=img_i.astype("uint8")
-            for n in range(shape(masked_image)[0]):
-                void = label(img_int1[n,:,:],background=0)
-                RegionID, RegionSize= unique(void,return_counts=True)
-                exclusion=asarray(RegionSize>58).nonzero()    
-                dusted_values=RegionID[exclusion]
-                count=numpy.sum(exclusion)
-                if count <= 10 or n>heightLimit:
-                    dusted_i[n,:,:] = ones(shape(void))
-                else:
-                    dusted_i[n,:,:] = void==dusted_values.any()
-
-            img_ii = img_shave >= ((per-drop)*numpy.max(img_shave))
-            dusted_ii  =zeros(shape(img_shave))
-            
-            img_int2=img_ii.astype("uint8")
-            for n in range(shape(masked_image)[0]):
-                void = label(img_int2[n,:,:],background=0)
-                RegionID, RegionSize= unique(void,return_counts=True)
-                exclusion=asarray(RegionSize>58).nonzero()    
-                dusted_values=RegionID[exclusion]
-                count=numpy.sum(exclusion)
-                if count <= 10 or n>heightLimit:
-                    dusted_ii[n,:,:] = ones(shape(void))
-                else:
-                    dusted_ii[n,:,:] = void==dusted_values.any()
-            
-            img_iii = img_shave >= ((per-(2*drop))*numpy.max(img_shave))
-            dusted_iii  =zeros(shape(img_shave))
-            img_int3=img_iii.astype("uint8")
-            for n in range(shape(masked_image)[0]):
-                void = label(img_int3[n,:,:],background=0)
-                RegionID, RegionSize= unique(void,return_counts=True)
-                exclusion=asarray(RegionSize>58).nonzero()    
-                dusted_values=RegionID[exclusion]
-                count=numpy.sum(exclusion)
-                if count <= 10 or n>heightLimit:
-                    dusted_iii[n,:,:] = ones(shape(void))
-                else:
-                    dusted_iii[n,:,:] = void==dusted_values.any()
-            
-            voids_found=((img_i-dusted_i) + (img_ii-dusted_ii) + (img_iii-dusted_iii))>0      
-            mask=ArrayGridData((voids_found))
-            volume_from_grid_data(mask,session)
-
-        elif dups ==4:
-            img_i = img_shave >= (per*numpy.max(img_shave))
-            dusted_i  =zeros(shape(img_shave))
-            img_int1=img_i.astype("uint8")
-            for n in range(shape(masked_image)[0]):
-                void = label(img_int1[n,:,:],background=0)
-                RegionID, RegionSize= unique(void,return_counts=True)
-                exclusion=asarray(RegionSize>58).nonzero()    
-                dusted_values=RegionID[exclusion]
-                count=numpy.sum(exclusion)
-                if count <= 10 or n>heightLimit:
-                    dusted_i[n,:,:] = ones(shape(void))
-                else:
-                    dusted_i[n,:,:] = void==dusted_values.any()
-
-            img_ii = img_shave >= ((per-drop)*numpy.max(img_shave))
-            dusted_ii  =zeros(shape(img_shave))
-            
-            img_int2=img_ii.astype("uint8")
-            for n in range(shape(masked_image)[0]):
-                void = label(img_int2[n,:,:],background=0)
-                RegionID, RegionSize= unique(void,return_counts=True)
-                exclusion=asarray(RegionSize>58).nonzero()    
-                dusted_values=RegionID[exclusion]
-                count=numpy.sum(exclusion)
-                if count <= 10 or n>heightLimit:
-                    dusted_ii[n,:,:] = ones(shape(void))
-                else:
-                    dusted_ii[n,:,:] = void==dusted_values.any()
-                
-            img_iii = img_shave >= ((per-(2*drop))*numpy.max(img_shave))
-            dusted_iii  =zeros(shape(img_shave))
-            img_int3=img_iii.astype("uint8")
-            for n in range(shape(masked_image)[0]):
-                void = label(img_int3[n,:,:],background=0)
-                RegionID, RegionSize= unique(void,return_counts=True)
-                exclusion=asarray(RegionSize>58).nonzero()    
-                dusted_values=RegionID[exclusion]
-                count=numpy.sum(exclusion)
-                if count <= 10 or n>heightLimit:
-                    dusted_iii[n,:,:] = ones(shape(void))
-                else:
-                    dusted_iii[n,:,:] = void==dusted_values.any()
-            
-            img_iiii = img_shave >= ((per-(3*drop))*numpy.max(img_shave))
-            dusted_iiii  =zeros(shape(img_shave))
-            img_int4=img_iiii.astype("uint8")
-            for n in range(shape(masked_image)[0]):
-                void = label(img_int4[n,:,:],background=0)
-                RegionID, RegionSize= unique(void,return_counts=True)
-                exclusion=asarray(RegionSize>58).nonzero()    
-                dusted_values=RegionID[exclusion]
-                count=numpy.sum(exclusion)
-                if count <= 10 or n>heightLimit:
-                    dusted_iiii[n,:,:] = ones(shape(void))
-                else:
-                    dusted_iiii[n,:,:] = void==dusted_values.any()    
-            
-            voids_found=((img_i-dusted_i) + (img_ii-dusted_ii) + (img_iii-dusted_iii) + (img_iiii-dusted_iiii))>0      
-            mask=ArrayGridData((voids_found))
-            volume_from_grid_data(mask,session)
-    else:
-        img_i = img_shave >= (per*numpy.max(img_shave))
-        img_ii = img_shave >= ((per-drop)*numpy.max(img_shave))
-        img_iii = img_shave >= ((per-(2*drop))*numpy.max(img_shave))
-        img_iiii = img_shave >= ((per-(3*drop))*numpy.max(img_shave))
-
-        dusted_i  =zeros(shape(img_shave))
-        dusted_ii  =zeros(shape(img_shave))
-        dusted_iii  =zeros(shape(img_shave))
-        dusted_iiii  =zeros(shape(img_shave))
-        
-        img_int1=img_i.astype("uint8")
-        for n in range(shape(masked_image)[0]):
-            void = label(img_int1[n,:,:],background=0)
-            RegionID, RegionSize= unique(void,return_counts=True)
-            exclusion=asarray(RegionSize>58).nonzero()    
-            dusted_values=RegionID[exclusion]
-            count=numpy.sum(exclusion)
-            if count <= 10 or n>heightLimit:
-                dusted_i[n,:,:] = ones(shape(void))
-            else:
-                dusted_i[n,:,:] = void==dusted_values.any()
-        
-        img_int2=img_ii.astype("uint8")
-        for n in range(shape(masked_image)[0]):
-            void = label(img_int2[n,:,:],background=0)
-            RegionID, RegionSize= unique(void,return_counts=True)
-            exclusion=asarray(RegionSize>58).nonzero()    
-            dusted_values=RegionID[exclusion]
-            count=numpy.sum(exclusion)
-            if count <= 10 or n>heightLimit:
-                dusted_ii[n,:,:] = ones(shape(void))
-            else:
-                dusted_ii[n,:,:] = void==dusted_values.any()
-        
-        img_int3=img_iii.astype("uint8")
-        for n in range(shape(masked_image)[0]):
-            void = label(img_int3[n,:,:],background=0)
-            RegionID, RegionSize= unique(void,return_counts=True)
-            exclusion=asarray(RegionSize>58).nonzero()    
-            dusted_values=RegionID[exclusion]
-            count=numpy.sum(exclusion)
-            if count <= 10 or n>heightLimit:
-                dusted_iii[n,:,:] = ones(shape(void))
-            else:
-                dusted_iii[n,:,:] = void==dusted_values.any()
-
-        img_int4=img_iiii.astype("uint8")
-        for n in range(shape(masked_image)[0]):
-            void = label(img_int4[n,:,:],background=0)
-            RegionID, RegionSize= unique(void,return_counts=True)
-            exclusion=asarray(RegionSize>58).nonzero()    
-            dusted_values=RegionID[exclusion]
-            count=numpy.sum(exclusion)
-            if count <= 10 or n>heightLimit:
-                dusted_iiii[n,:,:] = ones(shape(void))
-            else:
-                dusted_iiii[n,:,:] = void==dusted_values.any()
-
-        voids_found=((img_i-dusted_i)+(img_ii-dusted_ii)+(img_iii-dusted_iii)+(img_iiii-dusted_iiii))>0
-        mask=ArrayGridData((voids_found))
-        volume_from_grid_data(mask,session)
+    return y_l, heightLimit
+
+def slice_edges(masked_image, chunk=8, workers=None):
+    """Canny edges (sigma 1) of every z-slice, run in chunks of slices on a thread pool and written
+    straight into one preallocated boolean volume."""
+    edges = zeros(shape(masked_image), dtype=bool)
+    depth = shape(masked_image)[0]
+
+    def detect(start):
+        for n in range(depth)[start:start + chunk]:
+            edges[n] = canny(masked_image[n,:,:],sigma=1)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(detect, range(0, depth, chunk)))
+    return edges
+
+class VoidComponents:
+    """In-plane connected components of img_shave thresholded at fractions of its maximum, kept for the
+    last few thresholded images. The images of one img_shave are nested, so each is known by its voxel
+    count and fractions selecting the same voxels (e.g. all those below its minimum) share components.
+    Images a voids() call has not seen are labeled together in one pass (see slice_components); another
+    minSize only re-applies the region size exclusions to the stored components."""
+
+    def __init__(self, img_shave, heightLimit, thresholds=4):
+        self.img_shave = img_shave
+        self.peak = numpy.max(img_shave)
+        self.heightLimit = heightLimit
+        self.thresholds = thresholds
+        self.components = OrderedDict()
+
+    @property
+    def nbytes(self):
+        """Memory held with every threshold stored: img_shave plus int32 labels per threshold."""
+        return self.img_shave.nbytes + self.thresholds * self.img_shave.size * 4
+
+    def voids(self, per, drop, levels, min_size=58):
+        """Voids of img_shave thresholded at per, per-drop, per-2*drop, ... (levels thresholds):
+        a voxel is a void when it is above more thresholds than it is dusted in (see dust_slices)."""
+        total = zeros(shape(self.img_shave), dtype=int32)
+        skip = arange(len(self.img_shave)) > self.heightLimit
+        for components in self.threshold([per - n*drop for n in range(levels)]):
+            total += components[0] > 0
+            total -= dust_slices(components, skip, min_size)
+        return total > 0
+
+    def threshold(self, fractions):
+        """slice_components of img_shave >= each fraction of its maximum."""
+        images = [self.img_shave >= (fraction*self.peak) for fraction in fractions]
+        keys = [int(count_nonzero(image)) for image in images]
+        new = OrderedDict((key, image) for key, image in zip(keys, images) if key not in self.components)
+        if new:
+            self.components.update(zip(new, slice_components(concatenate(list(new.values())), len(new))))
+        for key in keys:
+            self.components.move_to_end(key)
+        found = [self.components[key] for key in keys]
+        while len(self.components) > self.thresholds:
+            self.components.popitem(last=False)
+        return found
+
+def slice_components(stack, blocks=1):
+    """Connected regions of every 2D slice of a stack, labeled in one pass with an in-plane only
+    structuring element. As with skimage label(slice, background=0), labels run in raster order, so the
+    regions of slice n are the consecutive run of labels first[n]+1 .. after those of the slices before it.
+    The stack is split into blocks of equal depth (e.g. several thresholds of one image), each returned as
+    its labels, first, region sizes, the slice of each region and each region's position in its slice's
+    unique() labels (after the background when the slice has one)."""
+    structure = zeros((3, 3, 3), dtype=bool)
+    structure[1] = True
+    labels, regions = ndimage_label(stack, structure=structure)
+    depth = len(stack)
+
+    last = maximum.accumulate(labels.reshape(depth, -1).max(axis=1))
+    first = concatenate([[0], last[:-1]])
+    sizes = bincount(labels[stack], minlength=regions + 1)[1:]
+    ids = arange(1, len(sizes) + 1)
+    slice_of = numpy.searchsorted(last, ids)
+
+    background = bincount(slice_of, weights=sizes, minlength=depth) < stack[0].size
+    position = ids - first[slice_of] - 1 + background[slice_of]
+
+    step = max(depth // blocks, 1)
+    components = []
+    for start in range(0, depth, step):
+        stop = start + step
+        regions = slice(first[start], last[stop - 1])
+        components.append((labels[start:stop], first[start:stop], sizes[regions], slice_of[regions] - start,
+                           position[regions]))
+    return components
+
+def dust_slices(components, skip, min_size=58):
+    """Per slice region filter of find_voids on slice_components. A skip slice (above heightLimit), or a
+    slice whose regions over min_size voxels have unique() positions summing to at most 10, is all ones.
+    Otherwise a slice keeps its first region if any region is over min_size voxels, else its background."""
+    labels, first, sizes, slice_of, position = components
+    depth = len(labels)
+    big = sizes > min_size
+    count = bincount(slice_of[big], weights=position[big], minlength=depth)
+    any_big = bincount(slice_of[big], minlength=depth) > 0
+
+    dusted = labels == where(any_big, first + 1, 0)[:, None, None]
+    dusted[(count <= 10) | skip] = True
+    return dusted
 
 def void_size(session, surface, track, tp, output):
     """import tract export size yml"""
@@ -792,10 +1295,7 @@ def void_size(session, surface, track, tp, output):
     id = pixcc[ cen[2], cen[1], cen[0] ]  
     volume =count_nonzero(pixcc==id)* (.1028*.1028*.1028)
 
-    cd(session, str(output))
-    with open('volume.csv', 'ab') as f:
-        savetxt(f, column_stack([volume,tp]),
-            header=f"volume time_point", comments='')
+    _results.hold(session, output, 'volume', model_id(surface), tp, 'void_size', {}, volume=volume)
     
 def Void_Motion(session,track,t,output):
     l=numpy.zeros(numpy.shape(track.coords))[:,0]
@@ -806,85 +1306,482 @@ def Void_Motion(session,track,t,output):
     distance=sum(l)
     RMS= distance/sqrt(shape((track.coords)[0]))
     
-    cd(session, str(output))
-    with open('TrackMotion.csv', 'ab') as f:
-        savetxt(f, column_stack([t,distance,RMS]),
-            header=f"Track Distance Velocity/Frame", comments='')
+    _results.hold(session, output, 'TrackMotion', ','.join(model_id(m) for m in track.unique_structures), -1,
+                  'void_motion', {}, Track=t, Distance=distance, Velocity_per_Frame=RMS)
     
 
 
-def measure_composite(surface, green_map, magenta_map, radius):
+def measure_composite(surface, green_map, magenta_map, radius, method='knn', precision='double', accumulate='double'):
     """Measure the local intensity for 2 channels within radius r of the surface."""
-    green_coords, *green_indices = get_image_coords(surface, green_map)
-    _, green_index = query_tree(surface.vertices, green_coords.T, radius)
-    green_intensity = local_intensity(*green_indices, green_index)
-    magenta_coords, *magenta_indices = get_image_coords(surface, magenta_map)
-    _, magenta_index = query_tree(surface.vertices, magenta_coords.T, radius)
-    magenta_intensity = local_intensity(*magenta_indices, magenta_index)
-    surface.ch1 = green_intensity
-    surface.ch2 = magenta_intensity
-
-
-def get_image(surface, to_map):
-    """Get the isosurface volume mask and secondary channel."""
-    mask_vol = surface.volume.full_matrix().copy()
-    image_3d = to_map.volume.full_matrix().copy()
+    surface.ch1 = channel_intensity(surface, green_map, radius, method, precision, accumulate)
+    surface.ch2 = channel_intensity(surface, magenta_map, radius, method, precision, accumulate)
+
+
+def measure_multichannel(surface, maps, radius, method='ball', precision='double', accumulate='double'):
+    """Measure the local intensity of any number of channels within radius r of the surface.
+    The membrane shell and the neighbor query are shared by all channels; results go to ch1, ch2, ..."""
+    matrix = surface.volume.full_matrix()
+    region, offset = surface_region(surface.vertices, matrix.shape, radius)
+    shell = shell_mask(matrix[region], surface.volume.maximum_surface_level)
+    images = [image.volume.full_matrix()[region] for image in maps]
+    intensities = multichannel_from_image(surface.vertices, shell, images, offset, radius, method,
+                                          precision, accumulate)
+    for channel, face_intensity in enumerate(intensities.T, 1):
+        setattr(surface, f'ch{channel}', face_intensity)
+
+
+def multichannel_from_image(vertices, shell, images, offset, radius, method='ball', precision='double',
+                            accumulate='double'):
+    """Local intensity (vertices x channels) of every channel from one shell mask and one KDTree
+    over the shell voxels. Zero voxels are skipped per channel, as in the single channel tree,
+    so ball and convolve match measure intensity exactly while knn caps the shared shell."""
+    accumulate_type = precision_types(accumulate)[0]
+    if method == 'convolve':
+        return column_stack([convolve_intensity(image * shell, vertices - offset, radius, accumulate_type)
+                             for image in images])
+    # ChimeraX uses XYZ for image, but numpy uses ZYX, swap dims
+    shell = swapaxes(shell, 0, 2)
+    shell_coords = array(shell.nonzero()) + offset[:, None]
+    values = column_stack([swapaxes(image, 0, 2)[shell] for image in images]).astype(accumulate_type)
+    values[values == 0] = nan
+    _, _, face_int = query_stats(vertices, shell_coords.T, values, radius, method, precision, accumulate_type)
+    return face_int / face_int.mean(axis=0)
+
+
+def channel_intensity(surface, image, radius, method='knn', precision='double', accumulate='double',
+                      sample=None, spacing=None):
+    """Local intensity of one channel around the surface using the KDTree or convolution engine."""
+    if method == 'convolve':
+        return intensity_from_image(*frame_image(surface, image, radius), radius, method, precision, accumulate,
+                                    sample, spacing)
+    _, intensities, tree, _ = get_image_coords(surface, image, radius)
+
+    def measure(vertices):
+        return local_intensity(vertices, tree, intensities, radius, method, precision,
+                               precision_types(accumulate)[0])
+    return sample_measure(measure, surface.vertices, sample, spacing)
+
+
+def frame_image(surface, image, radius=None):
+    """Gather the vertices and cropped volumes of one frame. Reads ChimeraX models,
+    so call it on the main thread."""
+    return (surface.vertices, *get_image(surface, image, radius))
+
+
+def intensity_from_image(vertices, mask_vol, level, image_3d, offset, radius, method='knn', precision='double',
+                         accumulate='double', sample=None, spacing=None):
+    """Local intensity of one channel from gathered arrays. Uses no ChimeraX models or
+    the channel cache, so it is safe to run on a worker thread."""
+    masked_image = mask_image(mask_vol, level, image_3d)
+    accumulate_type = precision_types(accumulate)[0]
+    if method == 'convolve':
+        return sample_measure(lambda v: convolve_intensity(masked_image, v - offset, radius, accumulate_type),
+                              vertices, sample, spacing)
+    image_coords, intensities = get_coords(masked_image, precision_types(precision)[1])
+    image_coords += offset[:, None]
+    tree = KDTree(image_coords.T)
+
+    def measure(vertices):
+        return local_intensity(vertices, tree, intensities, radius, method, precision, accumulate_type)
+    return sample_measure(measure, vertices, sample, spacing)
+
+
+def composite_from_image(vertices, mask_vol, level, green_3d, offset, magenta_3d, radius, method='knn',
+                         precision='double', accumulate='double'):
+    """Local intensity of two channels sharing one surface, safe to run on a worker thread."""
+    green = intensity_from_image(vertices, mask_vol, level, green_3d, offset, radius, method, precision, accumulate)
+    magenta = intensity_from_image(vertices, mask_vol, level, magenta_3d, offset, radius, method, precision, accumulate)
+    return green, magenta
+
+
+def get_image(surface, to_map, radius=None):
+    """Get the isosurface volume mask and secondary channel.
+    With a radius both are cropped to the surface bounding box grown by radius, and
+    offset is the XYZ index of the crop origin (zeros when not cropped)."""
+    matrix = surface.volume.full_matrix()
+    region, offset = surface_region(surface.vertices, matrix.shape, radius)
+    mask_vol = matrix[region].copy()
+    image_3d = to_map.volume.full_matrix()[region].copy()
     level = surface.volume.maximum_surface_level
-    return mask_vol, level, image_3d
-
-
-def get_coords(image_3d):
-    """Get the coords for local intensity"""
+    return mask_vol, level, image_3d, offset
+
+
+def surface_region(vertices, shape, radius=None):
+    """ZYX slices of the vertex bounding box grown by radius plus the reach of
+    mask_image, and the XYZ offset of its origin."""
+    if radius is None or len(vertices) == 0:
+        return (slice(None),) * 3, zeros(3, dtype=int64)
+    # mask_image dilates by 2 and erodes by 4 voxels, keep that border out of reach
+    margin = radius + 5
+    low = maximum(floor(vertices.min(axis=0) - margin), 0).astype(int64)
+    high = minimum(ceil(vertices.max(axis=0) + margin) + 1, shape[::-1]).astype(int64)
+    high = maximum(high, low)
+    region = tuple(slice(lo, hi) for lo, hi in zip(low[::-1], high[::-1]))
+    return region, low
+
+
+def get_coords(image_3d, index_type=int64):
+    """Get the coords of the nonzero voxels for local intensity and their intensities in the
+    image's own type, without flattening a copy of the whole image."""
     # ChimeraX uses XYZ for image, but numpy uses ZYX, swap dims
     image_3d = swapaxes(image_3d, 0, 2)
-    image_coords = array(image_3d.nonzero())
-    flattened_image = image_3d.flatten()
-    pixel_indices = ravel_multi_index(image_coords, image_3d.shape)
-    return image_coords, flattened_image, pixel_indices
+    nonzero = image_3d != 0
+    image_coords = array(nonzero.nonzero(), dtype=index_type)
+    return image_coords, image_3d[nonzero]
 
 
 def mask_image(mask, level, image_3d):
-    """Mask the secondary channel based on the isosurface. Uses a 3D ball to dilate and erode with radius 2, then xor to make membrane mask."""
+    """Mask the secondary channel based on the isosurface membrane shell."""
+    image_3d *= shell_mask(mask, level)
+    return image_3d
+
+
+def shell_mask(mask, level):
+    """Membrane mask of the isosurface. Uses a 3D ball to dilate and erode with radius 2, then xor."""
     mask = mask >= level
     struct_el = iterate_structure(generate_binary_structure(3, 1), 2)
     mask_d = binary_dilation(mask, structure=struct_el)
     mask_e = binary_erosion(mask, structure=struct_el, iterations=2)
-    masked = mask_d ^ mask_e
-    image_3d *= masked
-    return image_3d
+    return mask_d ^ mask_e
+
+
+def query_tree(init_verts, to_map, radius=inf, knn=200, precision='double', chunk=50000):
+    """Create a KDtree from a set of points (or reuse a built one) and query for nearest neighbors.
+    index: flat index of nearest neighbors within radius, grouped by vertex
+    offsets: index[offsets[v]:offsets[v+1]] are the neighbors of vertex v
+    distance: Mean distance of nearest neighbors
+    Vertices are queried in chunks, so the dense k-neighbor matrices only exist for one chunk."""
+    tree = to_map if isinstance(to_map, KDTree) else KDTree(to_map)
+    float_type, index_type = precision_types(precision)
+    distance, index, counts = [], [], []
+    for start in range(0, len(init_verts), chunk):
+        dist, ind = tree.query(init_verts[start:start + chunk], k=range(
+            1, knn), distance_upper_bound=radius, workers=-1)
+        dist[dist == inf] = None
+        distance.append(nanmean(dist, axis=1).astype(float_type))
+        ind, count = _index(ind, tree.n)
+        index.append(ind.astype(index_type))
+        counts.append(count)
+    return _join(distance, index, counts, float_type, index_type)
+
+
+def ball_stats(init_verts, to_map, values, radius, precision='double', dtype=float64,
+               budget=BALL_PAIR_BUDGET):
+    """neighbor_stats of values over every point closer than radius to each vertex, without keeping
+    a neighbor index. Vertices are queried in chunks of about budget neighbor pairs (see _ball_chunks)
+    and each chunk is reduced as soon as it is found, so memory follows the budget, not the surface."""
+    tree = to_map if isinstance(to_map, KDTree) else KDTree(to_map)
+    index_type = precision_types(precision)[1]
+    stats = []
+    for verts in _ball_chunks(init_verts, tree, radius, budget):
+        pairs = KDTree(verts).sparse_distance_matrix(tree, radius, output_type='ndarray')
+        # sparse_distance_matrix keeps pairs at exactly radius; knn and convolve exclude them
+        pairs = pairs[pairs['v'] < radius]
+        offsets = zeros(len(verts) + 1, dtype=index_type if len(pairs) < 2**31 else int64)
+        cumsum(bincount(pairs['i'], minlength=len(verts)), out=offsets[1:])
+        index = pairs['j'][argsort(pairs['i'], kind='stable')].astype(index_type)
+        stats.append(neighbor_stats(values, index, offsets, dtype))
+    if not stats:
+        return neighbor_stats(values, zeros(0, dtype=index_type), zeros(1, dtype=index_type), dtype)
+    return tuple(concatenate(part) for part in zip(*stats))
+
+
+def _ball_chunks(init_verts, tree, radius, budget, stride=16):
+    """Split the vertices into runs of about budget neighbor pairs. Every stride-th vertex's neighbors
+    are counted (without listing them) and stand in for the vertices after it."""
+    sample = tree.query_ball_point(init_verts[::stride], radius, return_length=True, workers=-1)
+    estimate = repeat(sample, stride)[:len(init_verts)]
+    _, starts = unique((cumsum(estimate) - estimate) // max(budget, 1), return_index=True)
+    for start, stop in zip(starts, chain(starts[1:], [len(init_verts)])):
+        yield init_verts[start:stop]
+
+
+def query_stats(init_verts, to_map, values, radius, method='knn', precision='double', dtype=float64):
+    """neighbor_stats of values over the capped nearest neighbors (knn) or over every point closer
+    than radius (ball, reduced chunk by chunk in ball_stats)."""
+    if method == 'ball':
+        return ball_stats(init_verts, to_map, values, radius, precision, dtype)
+    _, index, offsets = query_tree(init_verts, to_map, radius, precision=precision)
+    return neighbor_stats(values, index, offsets, dtype)
+
+
+def precision_types(precision='double'):
+    """Float and index types of the double (float64, int64) or single (float32, int32) data path."""
+    if precision == 'single':
+        return float32, int32
+    return float64, int64
 
 
-def query_tree(init_verts, to_map, radius=inf, knn=200):
-    """Create a KDtree from a set of points and query for nearest neighbors.
-    index: index of nearest neighbors within radius
-    distance: Mean distance of nearest neighbors"""
-    tree = KDTree(to_map)
-    dist, index = tree.query(init_verts, k=range(
-        1, knn), distance_upper_bound=radius, workers=-1)
-    dist[dist == inf] = None
-    distance = nanmean(dist, axis=1)
-    index = array([_index(ind, tree.n) for ind in index], dtype=object)
-    return distance, index
+def _index(index, tree_max):
+    """Tree query pads with tree_max if there are no neighbors.
+    Drop the padding and flatten the rows into one index plus per-row counts."""
+    valid = index < tree_max
+    return index[valid], valid.sum(axis=1)
+
+
+def _join(distance, index, counts, float_type, index_type):
+    """Join per-chunk query results into distance, flat index and offsets.
+    Offsets share the index type (when they fit) so the CSR product does not copy the index."""
+    counts = concatenate(counts) if counts else zeros(0, dtype=int64)
+    offset_type = index_type if counts.sum() < 2**31 else int64
+    offsets = zeros(len(counts) + 1, dtype=offset_type)
+    cumsum(counts, out=offsets[1:])
+    distance = concatenate(distance) if distance else zeros(0, dtype=float_type)
+    index = concatenate(index) if index else zeros(0, dtype=index_type)
+    return distance, index, offsets
+
+
+def neighbor_stats(values, index, offsets, dtype=float64):
+    """Vectorized per-vertex sum, count and mean of values over the flat neighbor index.
+    values may hold one column per channel; every column is reduced in one sparse product
+    accumulated in dtype. NaN values are skipped; vertices without neighbors get a NaN mean."""
+    neighbors = csr_matrix((ones(len(index), dtype=dtype), index, offsets),
+                           shape=(len(offsets) - 1, len(values)))
+    valid = ~isnan(values)
+    total = neighbors @ where(valid, values, 0).astype(dtype, copy=False)
+    count = neighbors @ valid.astype(dtype)
+    with errstate(invalid='ignore', divide='ignore'):
+        average = total / count
+    return total, count, average
+
+
+def local_intensity(vertices, to_map, intensities, radius, method='knn', precision='double', dtype=float64):
+    """Measure local mean intensity normalized to mean of all."""
+    _, _, face_int = query_stats(vertices, to_map, intensities, radius, method, precision, dtype)
+    return face_int/face_int.mean()
 
 
-def _index(index, tree_max):
-    """Tree query pads with tree_max if there are no neighbors."""
-    index = index[index < tree_max]
-    return index
+def ball_kernel(radius, dtype=float64):
+    """Spherical kernel of voxels closer than radius to the center."""
+    reach = int(radius)
+    x, y, z = ogrid[-reach:reach + 1, -reach:reach + 1, -reach:reach + 1]
+    return ((x**2 + y**2 + z**2) < radius**2).astype(dtype)
 
 
-def local_intensity(flat_img, pixels, index):
-    """Measure local mean intensity normalized to mean of all."""
-    face_int = array([nanmean(flat_img[pixels[ind]]) for ind in index])
+def convolve_intensity(masked_image, vertices, radius, dtype=float64):
+    """Measure local mean intensity from FFT convolutions of the masked image and of its
+    nonzero support with a spherical kernel, sampled at the vertices by trilinear
+    interpolation. Cost follows the number of voxels, not the number of vertices."""
+    # ChimeraX uses XYZ for image, but numpy uses ZYX, swap dims
+    image_3d = swapaxes(masked_image, 0, 2)
+    kernel = ball_kernel(radius, dtype)
+    total = fftconvolve(image_3d.astype(dtype), kernel, mode='same')
+    count = fftconvolve((image_3d != 0).astype(dtype), kernel, mode='same')
+    total = map_coordinates(total, vertices.T, order=1)
+    count = map_coordinates(count, vertices.T, order=1)
+    # FFT round off leaves tiny counts where the ball holds no voxels
+    count[count < 0.5] = nan
+    face_int = total / count
     return face_int/face_int.mean()
 
 
-def get_image_coords(surface, image):
-    """Get the image coordinates for use in KDTree."""
-    image_info = get_image(surface, image)
-    masked_image = mask_image(*image_info)
-    image_coords, *flattened_indices = get_coords(masked_image)
-    return image_coords, *flattened_indices
+def get_image_coords(surface, image, radius=None):
+    """Get the image coordinates, their intensities and the KDTree built on them.
+    The image is cropped around the surface; coordinates are offset back into the volume.
+    Results are reused from the channel cache until the volumes or the surface level change,
+    or a larger radius than the cached crop is requested."""
+    key = _channel_cache.key(surface, image)
+    cached = _channel_cache.get(key)
+    if cached is None or (cached[3] is not None and (radius is None or cached[3] < radius)):
+        *image_info, offset = get_image(surface, image, radius)
+        masked_image = mask_image(*image_info)
+        image_coords, intensities = get_coords(masked_image)
+        image_coords += offset[:, None]
+        cached = image_coords, intensities, KDTree(image_coords.T), radius
+        _channel_cache.put(key, cached, (surface, image, surface.volume.data, image.volume.data))
+    return cached
+
+
+class ChannelCache:
+    """Least recently used cache of masked voxel coordinates, intensities and KDTrees, and of the
+    find voids stages. Entries are keyed by map model, surface model, surface level and the data
+    version of both volumes (find voids: stage and map data, data version and parameters), and are
+    evicted oldest first once the memory budget (MB) is exceeded. Each entry holds the objects
+    whose ids are in its key, so the ids cannot be reused by newly opened models while it is
+    cached, and entries of deleted models are dropped."""
+
+    def __init__(self, budget=1024):
+        self.budget = budget * 2**20
+        self.entries = OrderedDict()
+
+    def key(self, surface, image):
+        """Cache key for a surface and the map measured against it."""
+        models = (id(image), id(surface))
+        level = surface.volume.maximum_surface_level
+        return models, level, self.version(surface.volume.data), self.version(image.volume.data)
+
+    @staticmethod
+    def version(data):
+        """Version of a volume's grid data, kept on the data and bumped whenever its values or
+        coordinates change."""
+        if not hasattr(data, 'measure_version'):
+            data.measure_version = 0
+
+            def changed(change_type):
+                if change_type in ('values changed', 'coordinates changed'):
+                    data.measure_version += 1
+            data.add_change_callback(changed)
+        return data.measure_version
+
+    def get(self, key):
+        """Return the cached entry or None, dropping stale entries for the same models."""
+        self.purge()
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+        for stale in [k for k in self.entries if k[0] == key[0]]:
+            del self.entries[stale]
+        return None
+
+    def put(self, key, value, owners=()):
+        """Store an entry, holding the owners (models and grid data) whose ids are in the key,
+        and evict the least recently used ones over budget."""
+        self.entries[key] = value, sum(_nbytes(item) for item in value), owners
+        self.evict()
+
+    def purge(self):
+        """Drop the entries of deleted models."""
+        for key in [k for k, (_, _, owners) in self.entries.items()
+                    if any(getattr(owner, 'deleted', False) for owner in owners)]:
+            del self.entries[key]
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits the budget."""
+        while self.entries and self.nbytes() > self.budget:
+            self.entries.popitem(last=False)
+
+    def resize(self, budget):
+        """Set a new memory budget in MB."""
+        self.budget = budget * 2**20
+        self.evict()
+
+    def clear(self):
+        """Drop every entry."""
+        self.entries.clear()
+
+    def nbytes(self):
+        """Memory held by the cached entries."""
+        return sum(size for _, size, _ in self.entries.values())
+
+
+def _nbytes(item):
+    """Approximate memory of an array or KDTree."""
+    if isinstance(item, KDTree):
+        return item.data.nbytes + item.indices.nbytes
+    return getattr(item, 'nbytes', 0)
+
+
+_channel_cache = ChannelCache()
+
+
+class ResultsStore:
+    """Buffered, columnar results tables. Every row is keyed by Model, Frame, Command and Parameters
+    and written as typed npz chunks (directory/<table>/<chunk>.npz) plus a CSV export with a single
+    header (directory/<table>.csv); read_results loads the chunks back. Outside a batch each add is
+    written straight away, inside one (series commands) rows are written when the batch ends or
+    chunk_rows rows are pending. Commands run once per frame hold their rows instead (see hold)."""
+
+    def __init__(self, chunk_rows=10000):
+        self.chunk_rows = chunk_rows
+        self.buffers = OrderedDict()
+        self.depth = 0
+        self.quit_handler = None
+
+    @contextmanager
+    def batch(self):
+        """Buffer rows until the outermost batch ends."""
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.flush()
+
+    def add(self, directory, table, model, frame, command, parameters, **columns):
+        """Add rows to a table. Columns are scalars or equal length arrays, one row per element;
+        model, frame and command are broadcast over them and parameters is a dict of the settings.
+        Measurements over a whole series use frame -1."""
+        columns = {name: numpy.atleast_1d(asarray(value)) for name, value in columns.items()}
+        rows = max((len(value) for value in columns.values()), default=1)
+        keys = {'Model': model, 'Frame': frame, 'Command': command,
+                'Parameters': ';'.join(f'{name}={value}' for name, value in parameters.items())}
+        values = {name: numpy.broadcast_to(asarray(value), (rows,))
+                  for name, value in chain(keys.items(), columns.items())}
+        buffer = self.buffers.setdefault((directory, table), OrderedDict())
+        for name, value in values.items():
+            buffer.setdefault(name, []).append(value)
+        if self.depth == 0 or sum(len(part) for part in buffer['Model']) >= self.chunk_rows:
+            self.flush((directory, table))
+
+    def hold(self, session, directory, table, model, frame, command, parameters, **columns):
+        """Add rows for a command that runs once per frame (e.g. through perframe). They stay pending
+        until chunk_rows rows are, a batch ends, read_results is called or ChimeraX quits, so a long
+        series writes a few large chunks instead of a chunk and a CSV append per frame."""
+        if self.quit_handler is None:
+            self.quit_handler = session.triggers.add_handler('app quit', lambda *_: self.flush())
+        self.depth += 1
+        try:
+            self.add(directory, table, model, frame, command, parameters, **columns)
+        finally:
+            self.depth -= 1
+
+    def flush(self, key=None):
+        """Write the pending rows of one (directory, table) or of every table."""
+        for key in [key] if key is not None else list(self.buffers):
+            buffer = self.buffers.pop(key, None)
+            if buffer:
+                self.write(*key, {name: concatenate(parts) for name, parts in buffer.items()})
+
+    @staticmethod
+    def write(directory, table, columns):
+        """Append one npz chunk and the matching CSV rows."""
+        chunks = join(directory, table)
+        makedirs(chunks, exist_ok=True)
+        count = len([name for name in listdir(chunks) if name.endswith('.npz')])
+        numpy.savez(join(chunks, f'{count:06d}.npz'), **columns)
+
+        csv = join(directory, table + '.csv')
+        header = not exists(csv)
+        with open(csv, 'a') as f:
+            if header:
+                f.write(' '.join(columns) + '\n')
+            f.writelines(' '.join(str(value) for value in row) + '\n' for row in zip(*columns.values()))
+
+
+def read_results(directory, table, **where):
+    """Load a results table as a dict of column arrays, keeping the rows whose columns equal the
+    given values, e.g. read_results(output, 'intensity', Frame=3). Held rows are written first."""
+    _results.flush()
+    chunks = join(directory, table)
+    parts = [numpy.load(join(chunks, name)) for name in sorted(listdir(chunks)) if name.endswith('.npz')]
+    if not parts:
+        return {}
+    columns = {name: concatenate([part[name] for part in parts]) for name in parts[0].files}
+    keep = ones(len(columns['Model']), dtype=bool)
+    for name, value in where.items():
+        keep &= columns[name] == value
+    return {name: column[keep] for name, column in columns.items()}
+
+
+def model_id(model):
+    """Dotted model id string, e.g. '1.3'."""
+    return '.'.join(str(i) for i in model.id)
+
+
+_results = ResultsStore()
+atexit.register(_results.flush)
+
+
+def measure_cache(session, size=None, clear=False):
+    """Set the memory budget (MB) of the measurement cache or clear it."""
+    if size is not None:
+        _channel_cache.resize(size)
+    if clear:
+        _channel_cache.clear()
+    _channel_cache.purge()
+    session.logger.info(f'Measure cache: {len(_channel_cache.entries)} entries, '
+                        f'{_channel_cache.nbytes() / 2**20:.1f} of {_channel_cache.budget / 2**20:.0f} MB')
 
 
 def recolor_surface(session, surface, metric, palette, color_range, key):
@@ -938,6 +1835,10 @@ def recolor_surface(session, surface, metric, palette, color_range, key):
         measurement = surface.edges * 1
         palette_string = 'purples'
         max_range = 10
+    elif metric.startswith('ch') and hasattr(surface, metric):
+        measurement = getattr(surface, metric)
+        palette_string = 'purples'
+        max_range = 5
     elif metric == 'qd' and hasattr(surface, 'q_dist'):
         measurement = surface.q_dist.astype('int64')
         palette_string = 'brbg'
@@ -947,7 +1848,7 @@ def recolor_surface(session, surface, metric, palette, color_range, key):
 
     # If all the measurements are np.nan set them to zero.
     if isnan(measurement).all():
-        measurement[:] = 0
+        measurement = zeros(shape(measurement))
 
     if palette is None:
         palette = colors.BuiltinColormaps[palette_string]
@@ -1028,6 +1929,12 @@ measure_distance_desc = CmdDesc(
     required=[('surface', SurfacesArg)],
     keyword=[('to_surface', SurfacesArg),
              ('knn', Bounded(IntArg)),
+             ('method', EnumOf(['knn', 'mesh'])),
+             ('signed', BoolArg),
+             ('sample', Bounded(IntArg, 1)),
+             ('sample_spacing', Bounded(FloatArg, 0)),
+             ('parallel', Bounded(IntArg, 1)),
+             ('precision', EnumOf(['double', 'single'])),
              ('palette', ColormapArg),
              ('color_range', ColormapRangeArg),
              ('key', BoolArg)],
@@ -1044,6 +1951,13 @@ measure_intensity_desc = CmdDesc(
              ('znorm',FloatArg),
              ('output',StringArg),
              ('blob', Bounded(IntArg, 1 , 4)),
+             ('sample', Bounded(IntArg, 1)),
+             ('sample_spacing', Bounded(FloatArg, 0)),
+             ('method', EnumOf(['knn', 'ball', 'convolve'])),
+             ('precision', EnumOf(['double', 'single'])),
+             ('accumulate', EnumOf(['double', 'single'])),
+             ('parallel', Bounded(IntArg, 1)),
+             ('stream', StringArg),
              ('palette', ColormapArg),
              ('color_range', ColormapRangeArg),
              ('key', BoolArg)],
@@ -1056,15 +1970,35 @@ measure_composite_desc = CmdDesc(
     keyword=[('green_map', SurfacesArg),
              ('magenta_map', SurfacesArg),
              ('radius', Bounded(IntArg, 1, 30)),
+             ('method', EnumOf(['knn', 'ball', 'convolve'])),
+             ('precision', EnumOf(['double', 'single'])),
+             ('accumulate', EnumOf(['double', 'single'])),
+             ('parallel', Bounded(IntArg, 1)),
+             ('stream', StringArg),
              ('green_range', ColormapRangeArg),
              ('magenta_range', ColormapRangeArg)],
     required_arguments=['green_map', 'magenta_map'],
     synopsis='Measure local intensities of two channels relative to surface')
 
 
+measure_multichannel_desc = CmdDesc(
+    required=[('surface', SurfacesArg)],
+    keyword=[('to_map', RepeatOf(SurfacesArg)),
+             ('radius', Bounded(IntArg, 1, 30)),
+             ('method', EnumOf(['knn', 'ball', 'convolve'])),
+             ('precision', EnumOf(['double', 'single'])),
+             ('accumulate', EnumOf(['double', 'single'])),
+             ('palette', EnumOf(['green_magenta', 'magenta_green'])),
+             ('color_range', ColormapRangeArg),
+             ('key', BoolArg)],
+    required_arguments=['to_map'],
+    synopsis='Measure local intensities of any number of channels relative to surface')
+
+
 recolor_surfaces_desc = CmdDesc(
     required=[('surface', SurfacesArg)],
-    keyword=[('metric', EnumOf(['intensity', 'distance','R', 'theta', 'phi', 'Rphi', 'rpg','rpd', 'area', 'edges', 'qd', 'bottom','top'])),
+    keyword=[('metric', EnumOf(['intensity', 'distance','R', 'theta', 'phi', 'Rphi', 'rpg','rpd', 'area', 'edges', 'qd', 'bottom','top',
+                                'ch1', 'ch2', 'ch3', 'ch4'])),
              ('palette', ColormapArg),
              ('color_range', ColormapRangeArg),
              ('key', BoolArg)],
@@ -1090,6 +2024,8 @@ measure_topology_desc = CmdDesc(
              ('target', EnumOf(['sRBC', 'mRBC'])),
              ('color_range', ColormapRangeArg),
              ('phi_lim', Bounded(IntArg)),
+             ('phi_lims', FloatsArg),
+             ('radii', FloatsArg),
              ('output', StringArg),
              ('key', BoolArg)],
     required_arguments=['to_cell'],
@@ -1097,9 +2033,9 @@ measure_topology_desc = CmdDesc(
         'based on inputs surface-Macrophage, tocell- target, radius- search radius (um), targetr- target radius (um)')
 
 measure_ridges_desc = CmdDesc(
-    required=[('surface',SurfaceArg)],
-    keyword=[('to_surface', SurfaceArg),
-             ('to_cell', SurfaceArg),
+    required=[('surface',SurfacesArg)],
+    keyword=[('to_surface', SurfacesArg),
+             ('to_cell', SurfacesArg),
              ('smoothing_iterations', Bounded(IntArg)),
              ('thresh', Bounded(FloatArg)),
              ('palette', ColormapArg),
@@ -1110,19 +2046,24 @@ measure_ridges_desc = CmdDesc(
              ('output', StringArg),
              ('track', BoolArg),
              ('exclusion', Bounded(FloatArg)),
+             ('parallel', Bounded(IntArg, 1)),
+             ('figures', BoolArg),
              ('key', BoolArg)],
     required_arguments = ['to_surface','to_cell'],
     synopsis = 'Current implimentation focuses on identifying high curvature'
         'lamella edges for video recodings')
 
 find_voids_desc = CmdDesc(
-    required=[('surface',SurfaceArg)],
+    required=[('surface',SurfacesArg)],
     keyword=[('bg', FloatArg),
              ('sd', Bounded(FloatArg,0,1)),
              ('stg', Bounded(FloatArg,0,1)),
              ('dups', Bounded(IntArg,1,4)),
              ('per', Bounded(FloatArg,0,1)),
-             ('drop', Bounded(FloatArg,0,.99))],
+             ('drop', Bounded(FloatArg,0,.99)),
+             ('min_size', Bounded(IntArg,0)),
+             ('output', StringArg),
+             ('parallel', Bounded(IntArg,1))],
     synopsis = 'This function is designed to find voids in a surface rendering.')
 
 void_size_desc = CmdDesc(
@@ -1133,6 +2074,24 @@ void_size_desc = CmdDesc(
     required_arguments = ['surface','track','tp','output'],
     synopsis='output volume')
 
+measure_cache_desc = CmdDesc(
+    keyword=[('size', Bounded(IntArg, 0)),
+             ('clear', BoolArg)],
+    synopsis='Set the memory budget (MB) of the measurement cache or clear it')
+
+measure_export_desc = CmdDesc(
+    required=[('surface', SurfacesArg)],
+    keyword=[('directory', StringArg),
+             ('attributes', ListOf(StringArg))],
+    required_arguments=['directory'],
+    synopsis='Write per-vertex measurements, vertices and triangles of a series to memory-mappable .npy files')
+
+measure_import_desc = CmdDesc(
+    required=[('surface', SurfacesArg)],
+    keyword=[('directory', StringArg)],
+    required_arguments=['directory'],
+    synopsis='Load per-vertex measurements written by measure export back onto a series')
+
 Void_Motion_desc = CmdDesc(
     required=[('track', AtomsArg)],
     keyword=[('t',IntArg),